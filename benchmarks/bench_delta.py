@@ -0,0 +1,518 @@
+"""
+delta benchmarks: dictionary load, lookup, answer expansion, parse, TCP server and webhook
+
+Latency percentiles and throughput are reported for every stage and dictionary,
+synthetic dictionaries of different sizes show how the engine scales with entry count.
+Results can be saved and compared with a saved baseline (exit code 1 on regression).
+
+Usage example:
+
+    PYTHONPATH=. python benchmarks/bench_delta.py --entries 1000,10000,100000
+    PYTHONPATH=. python benchmarks/bench_delta.py --stages load,lookup data/dictionary-russian.xml
+    PYTHONPATH=. python benchmarks/bench_delta.py --save baseline.json
+    PYTHONPATH=. python benchmarks/bench_delta.py --compare baseline.json
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from delta import delta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = ["load", "lookup", "answer", "parse", "tcp", "webhook"]
+
+WORDS = [
+    "hello",
+    "bye",
+    "time",
+    "date",
+    "weather",
+    "work",
+    "home",
+    "music",
+    "movie",
+    "book",
+    "game",
+    "food",
+    "coffee",
+    "tea",
+    "friend",
+    "robot",
+    "computer",
+    "phone",
+    "money",
+    "love",
+    "cat",
+    "dog",
+    "sun",
+    "rain",
+    "snow",
+    "city",
+    "road",
+    "train",
+    "plane",
+]
+
+SUMMARY_KEYS = ("count", "mean", "p50", "p90", "p99", "max", "ops")
+
+SERVER_START_TIMEOUT = 300  # large dictionaries are loaded before the server starts listening
+
+
+def word(num):
+    """synthetic entry word"""
+    return WORDS[num % len(WORDS)]
+
+
+def generate_dictionary(filename, entries, seed=0):
+    """
+    write synthetic XML dictionary: plain, alternation and macro patterns, some exclusions,
+    answers with macros and a macro-heavy `tell me a story` entry
+    """
+
+    rng = random.Random(seed)
+
+    def _entry(patterns, answers, priority=0, exclusions=()):
+        return (
+            f"<entry priority='{priority}'><patterns>"
+            + "".join(f"<pattern>{x}</pattern>" for x in patterns)
+            + "".join(f"<pattern type='exc'>{x}</pattern>" for x in exclusions)
+            + "</patterns><answers>"
+            + "".join(f"<answer>{x}</answer>" for x in answers)
+            + "</answers></entry>\n"
+        )
+
+    with open(filename, "w", encoding="utf-8") as outfile:
+        outfile.write("<?xml version='1.0' encoding='utf-8'?>\n<dictionary version='1.0'>\n")
+        outfile.write(_entry(["\\$word\\$"], WORDS))
+        outfile.write(_entry(["\\$phrase\\$"], ["$word$ $word$ $word$", "$word$ or $word$", "$word$"]))
+        outfile.write(_entry(["tell me a story"], ["$phrase$, then $phrase$ and $phrase$."], priority=1))
+        for num in range(entries):
+            first, second = word(num), rng.choice(WORDS)
+            patterns = [f"\\b{first}{num}\\b", f"({first}|{second}) {num}"]
+            exclusions = [f"not {first}"] if num % 5 == 0 else []
+            answers = [f"{second} {num}", f"$word$ and {first}"]
+            outfile.write(_entry(patterns, answers, num % 3, exclusions))
+        outfile.write("</dictionary>\n")
+
+
+def generate_corpus(entries, count, seed=0):
+    """synthetic inputs: hits of random entries (early and late ones), misses and stories"""
+
+    rng = random.Random(seed)
+    corpus = []
+
+    for _ in range(count):
+        dice = rng.random()
+        if dice < 0.5:
+            num = rng.randrange(entries)
+            corpus.append(f"{rng.choice(WORDS)} {word(num)}{num} {rng.choice(WORDS)}")
+        elif dice < 0.9:
+            corpus.append(" ".join(rng.sample(WORDS, 3)) + "?")
+        else:
+            corpus.append("please tell me a story")
+
+    return corpus
+
+
+def percentile(timings, pct):
+    """nearest-rank percentile of sorted timings"""
+    return timings[min(len(timings) - 1, int(len(timings) * pct / 100))]
+
+
+def summary(timings, wall=None):
+    """
+    latency percentiles (seconds) and throughput (operations per second),
+    throughput of concurrent requests is counted by `wall` time
+    """
+
+    timings = sorted(timings)
+    total = sum(timings)
+    return {
+        "count": len(timings),
+        "mean": total / (len(timings) or 1),
+        "p50": percentile(timings, 50) if timings else 0,
+        "p90": percentile(timings, 90) if timings else 0,
+        "p99": percentile(timings, 99) if timings else 0,
+        "max": timings[-1] if timings else 0,
+        "ops": len(timings) / ((wall or total) or 1),
+    }
+
+
+def timed(func, args_list):
+    """call function for every arguments tuple, returns timings"""
+
+    timings = []
+    clock = time.perf_counter
+    for args in args_list:
+        started = clock()
+        func(*args)
+        timings.append(clock() - started)
+
+    return timings
+
+
+def duration(seconds):
+    """human readable duration"""
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds:.3f}s"
+
+
+def report(name, stats):
+    """print one result line (with stage specific values)"""
+    extra = "".join(f" {key}={value:.1f}" for key, value in stats.items() if key not in SUMMARY_KEYS)
+    print(
+        f"{name:32} n={stats['count']:<6} p50={duration(stats['p50']):>9} p90={duration(stats['p90']):>9}"
+        f" p99={duration(stats['p99']):>9} max={duration(stats['max']):>9}"
+        f" {stats['ops']:>10.1f} ops/s{extra}",
+        flush=True,
+    )
+
+
+def bench_load(filename, repeat):
+    """dictionary load: XML parsing only and full `load_dictionary`"""
+
+    results = {}
+    for stage, load in (
+        ("parse_xml", lambda: delta._read_dictionary(filename)),  # pylint: disable=protected-access
+        ("load", lambda: delta.Delta().load_dictionary(filename)),
+    ):
+        results[stage] = summary(timed(load, [()] * repeat))
+
+    engine = delta.Delta()
+    count = engine.load_dictionary(filename)
+    for stats in results.values():
+        stats["entries_per_sec"] = count * stats["ops"]
+        stats["mb_per_sec"] = os.path.getsize(filename) / 2**20 * stats["ops"]
+
+    return results, engine
+
+
+def bench_lookup(engine, corpus):
+    """
+    `Dictionary.lookup` by input kind: miss, hit and late hit
+    (matched entry is one of the last 10% in lookup order)
+    """
+
+    corpus = [engine.clean_input(x) for x in corpus]  # as `Delta.parse` does, not timed
+    dictionary = engine.dictionary
+    entries = dictionary.entries
+    position = {id(x): pos for pos, x in enumerate(entries)}
+    late = len(entries) - max(1, len(entries) // 10)
+
+    kinds = {"lookup_hit": [], "lookup_late": [], "lookup_miss": []}
+    for inline in corpus:
+        entry, _ = dictionary.lookup(inline)  # also compiles patterns in lazy mode
+        if entry is None:
+            kinds["lookup_miss"].append((inline,))
+        elif position[id(entry)] >= late:
+            kinds["lookup_late"].append((inline,))
+        else:
+            kinds["lookup_hit"].append((inline,))
+
+    return {kind: summary(timed(dictionary.lookup, args)) for kind, args in kinds.items() if args}
+
+
+def bench_answer(engine, corpus):
+    """`process_answer` of entries with macros in answers"""
+
+    matches = []
+    for inline in corpus:
+        entry, emo = engine.dictionary.lookup(engine.clean_input(inline))
+        if entry is not None and any(x[0] == delta.Answer.MACRO for y in entry.answers for x in y.template):
+            matches.append((emo, entry, 0, random.Random(len(matches))))
+
+    if not matches:
+        return {}
+
+    return {"answer": summary(timed(engine.process_answer, matches))}
+
+
+def bench_parse(engine, corpus):
+    """end-to-end `Delta.parse`"""
+    return {"parse": summary(timed(engine.parse, [(x,) for x in corpus]))}
+
+
+def free_port():
+    """unused local TCP port"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, port):
+    """start server process and wait until it listens on the port"""
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, *args], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError(f"server did not start: {args}")
+
+
+def stop_server(process):
+    """stop server process"""
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def tcp_clients(port, corpus, concurrency):
+    """persistent connections, every client sends its share of the corpus line by line"""
+
+    timings = []
+
+    async def _client(lines):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for line in lines:
+            started = time.perf_counter()
+            writer.write(line.encode("utf-8") + b"\n")
+            await writer.drain()
+            await reader.readline()
+            timings.append(time.perf_counter() - started)
+        writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_client(corpus[num::concurrency]) for num in range(concurrency)))
+
+    return summary(timings, time.perf_counter() - started)
+
+
+def bench_tcp(filename, corpus, concurrency):
+    """async TCP server (delta_commander) requests per second"""
+
+    port = free_port()
+    process = start_server(
+        [
+            os.path.join(ROOT, "clients", "delta_commander.py"),
+            "--tcpserver",
+            "127.0.0.1",
+            str(port),
+            "--tcpserver-async",
+            "--tcpserver-persistent",
+            "--tcpserver-max-connections",
+            str(concurrency + 1),
+            filename,
+        ],
+        port,
+    )
+
+    try:
+        return {"tcp": asyncio.run(tcp_clients(port, corpus, concurrency))}
+    finally:
+        stop_server(process)
+
+
+async def webhook_clients(port, sink_port, corpus, concurrency):
+    """
+    post telegram updates to the webhook (one chat per client),
+    answers which are not returned inline are posted to the sink (fake telegram API)
+    """
+
+    import aiohttp  # pylint: disable=import-outside-toplevel
+    from aiohttp import web  # pylint: disable=import-outside-toplevel
+
+    later = []
+
+    async def _sink(request):
+        later.append(await request.json())
+        return web.json_response({"ok": True})
+
+    sink = web.Application()
+    sink.add_routes([web.post("/{path:.*}", _sink)])
+    runner = web.AppRunner(sink)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", sink_port).start()
+
+    timings = []
+    inline = []
+
+    async def _client(session, chat_id, lines):
+        for line in lines:
+            update = {"message": {"chat": {"id": chat_id}, "from": {"id": chat_id}, "text": line}}
+            started = time.perf_counter()
+            async with session.post(f"http://127.0.0.1:{port}/hook", json=update) as response:
+                reply = await response.json()
+            timings.append(time.perf_counter() - started)
+            if reply.get("text"):
+                inline.append(reply)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(
+            *(_client(session, num + 1, corpus[num::concurrency]) for num in range(concurrency))
+        )
+    stats = summary(timings, time.perf_counter() - started)
+
+    await asyncio.sleep(1)  # late answers
+    await runner.cleanup()
+
+    stats["inline"] = len(inline)
+    stats["later"] = len(later)
+    return stats
+
+
+def bench_webhook(filename, corpus, concurrency):
+    """telegram bot webhook (delta_tgbot) requests per second"""
+
+    port, sink_port = free_port(), free_port()
+    process = start_server(
+        [
+            os.path.join(ROOT, "clients", "delta_tgbot.py"),
+            "--api-token",
+            "0:bench",
+            "--api-url",
+            f"http://127.0.0.1:{sink_port}/bot{{token}}/{{cmd}}",
+            "--webhook-url",
+            "/hook",
+            "--max-in-flight",
+            str(concurrency * 2),
+            "--port",
+            str(port),
+            filename,
+        ],
+        port,
+    )
+
+    try:
+        return {"webhook": asyncio.run(webhook_clients(port, sink_port, corpus, concurrency))}
+    finally:
+        stop_server(process)
+
+
+def run(filename, label, corpus, args):
+    """run selected stages for one dictionary, returns {stage@label: stats}"""
+
+    results = {}
+
+    def _add(stage_results):
+        for stage, stats in stage_results.items():
+            name = f"{stage}@{label}"
+            results[name] = stats
+            report(name, stats)
+
+    load_results, engine = bench_load(filename, args.repeat)
+    if "load" in args.stages:
+        _add(load_results)
+    if "lookup" in args.stages:
+        _add(bench_lookup(engine, corpus))
+    if "answer" in args.stages:
+        _add(bench_answer(engine, corpus))
+    if "parse" in args.stages:
+        _add(bench_parse(engine, corpus))
+    if "tcp" in args.stages:
+        _add(bench_tcp(filename, corpus, args.concurrency))
+    if "webhook" in args.stages:
+        _add(bench_webhook(filename, corpus, args.concurrency))
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    compare median latency with baseline,
+    returns names of stages which are slower by more than `threshold` (fraction)
+    """
+
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if base is None or not base["p50"]:
+            continue
+        change = stats["p50"] / base["p50"] - 1
+        slower = change > threshold
+        if slower:
+            regressions.append(name)
+        print(
+            f"{name:32} p50 {duration(base['p50']):>9} -> {duration(stats['p50']):>9}"
+            f" {change:+7.1%}{'  REGRESSION' if slower else ''}"
+        )
+
+    return regressions
+
+
+def main():
+    """command line interface"""
+
+    parser = argparse.ArgumentParser(description="delta benchmarks")
+    parser.add_argument("dictionary", nargs="*", help="XML dictionary (default: synthetic ones)")
+    parser.add_argument(
+        "--entries", default="1000,10000", help="synthetic dictionary sizes (comma separated)"
+    )
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"stages to run: {','.join(STAGES)}")
+    parser.add_argument(
+        "--inputs", metavar="FILE", help="input corpus, one phrase per line (default: synthetic)"
+    )
+    parser.add_argument("--count", type=int, default=3000, help="synthetic corpus size")
+    parser.add_argument("--repeat", type=int, default=3, help="dictionary loads per file")
+    parser.add_argument("--concurrency", type=int, default=8, help="TCP and webhook clients")
+    parser.add_argument("--lazy-compile", action="store_true", default=False)
+    parser.add_argument("--no-index", action="store_true", default=False, help="disable lookup index")
+    parser.add_argument("--combined", action="store_true", default=False, help="use combined matcher")
+    parser.add_argument("--save", metavar="FILE", help="save results (JSON)")
+    parser.add_argument("--compare", metavar="FILE", help="compare with saved baseline (JSON)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p50 slowdown (fraction)")
+    args = parser.parse_args()
+
+    args.stages = set(args.stages.split(","))
+    delta.Dictionary.lazy_compile = args.lazy_compile
+    delta.Dictionary.use_index = not args.no_index
+    delta.Dictionary.use_combined = args.combined
+
+    corpus = None
+    if args.inputs:
+        with open(args.inputs, encoding="utf-8") as infile:
+            corpus = [x.strip() for x in infile if x.strip()]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.dictionary:
+            if corpus is None:
+                print("no input corpus (--inputs), only dictionary load is measured")
+            for filename in args.dictionary:
+                results.update(run(filename, os.path.basename(filename), corpus or [], args))
+        else:
+            for entries in map(int, args.entries.split(",")):
+                filename = os.path.join(tmpdir, f"synthetic-{entries}.xml")
+                generate_dictionary(filename, entries)
+                results.update(run(filename, entries, corpus or generate_corpus(entries, args.count), args))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as outfile:
+            json.dump(results, outfile, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as infile:
+            baseline = json.load(infile)
+        if compare(results, baseline, args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
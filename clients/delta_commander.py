@@ -3,16 +3,110 @@ delta demo -- command line client and tiny server
 """
 
 import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import gc
+import http.server
+import json
 import logging
+import multiprocessing
+import os
 import re
 import select
+import signal
 import socket
 import sys
+import threading
+import time
 
-from delta import delta
+from delta import delta, metrics
 
 SERVER_READ_TIMEOUT = 5
 SERVER_INPUT_MAXSIZE = 1024 * 1
+SERVER_MAX_CONNECTIONS = 100
+SERVER_PARSE_THREADS = 4
+SERVER_BACKLOG = 128
+SERVER_RESPAWN_DELAY = 1
+
+BATCH_CHUNK_SIZE = 64
+BATCH_BUFFER_SIZE = 1024 * 64
+
+BATCH_ENGINE = None  # engine for batch workers (inherited by fork or loaded by initializer)
+
+SERVER_METRICS = None  # TCP server metrics (see `ServerMetrics`, `--metrics`)
+
+
+class ServerMetrics:
+    """
+    TCP server metrics (Prometheus text format via HTTP, see `serve_metrics`),
+    pre-forked workers write into shared memory, the parent process renders the sum
+    """
+
+    def __init__(self, engine, load_seconds=0.0):
+        self.engine = engine
+        self.registry = registry = metrics.Registry()
+        self.requests = registry.counter("delta_requests_total", "input lines answered")
+        self.connections = registry.counter("delta_connections_total", "client connections accepted")
+        self.active = registry.gauge("delta_active_connections", "client connections being served")
+        self.errors = {
+            kind: registry.counter("delta_errors_total", "client errors", {"kind": kind})
+            for kind in ("timeout", "too_long", "connection", "rejected")
+        }
+        self.parse_seconds = registry.histogram("delta_parse_seconds", "parse latency (seconds)")
+        self.cache_hits = registry.counter("delta_lookup_cache_hits_total", "lookup cache hits")
+        self.cache_misses = registry.counter("delta_lookup_cache_misses_total", "lookup cache misses")
+        self.exceeded = {
+            cause: registry.counter("delta_budget_exceeded_total", "inputs over budget", {"cause": cause})
+            for cause in engine.exceeded
+        }
+        registry.gauge("delta_dictionary_entries", "dictionary entries", func=lambda: len(engine.dictionary))
+        registry.gauge("delta_dictionary_load_seconds", "dictionaries load time", func=lambda: load_seconds)
+        self.reported = {}  # counter => engine total already added to it (by this process)
+
+    def parsed(self, seconds):
+        """count answered input line"""
+        self.requests.inc()
+        self.parse_seconds.observe(seconds)
+        cache = self.engine.cache
+        if cache is not None:
+            self.report(self.cache_hits, cache.hits)
+            self.report(self.cache_misses, cache.misses)
+        for cause, count in self.engine.exceeded.items():
+            self.report(self.exceeded[cause], count)
+
+    def report(self, counter, total):
+        """add increase of the engine total since the last report to the counter"""
+        counter.inc(total - self.reported.get(counter, 0))
+        self.reported[counter] = total
+
+
+def serve_metrics(registry, server_params):
+    """serve metrics at `/metrics` (HTTP server in a background thread), returns the server"""
+
+    class _Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):  # pylint: disable=invalid-name
+            """metrics page"""
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", metrics.CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            """no access log"""
+
+    server = http.server.ThreadingHTTPServer((server_params[0], int(server_params[1])), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="delta-metrics", daemon=True).start()
+    logging.info("metrics at http://%s:%s/metrics", *server_params)
+
+    return server
 
 
 def set_debugger(debug=False):
@@ -25,15 +119,15 @@ def set_debugger(debug=False):
     return logging.getLogger("delta")
 
 
-def init_delta(dicts):
-    """ " create delta instance and load dictionaries"""
+def init_delta(dicts, workers=None):
+    """ " create delta instance and load dictionaries (in parallel, errors are logged by the engine)"""
 
     engine = delta.Delta()
-    for dct in dicts:
-        try:
-            engine.load_dictionary(dct)
-        except Exception as exc:  # pylint: disable=broad-except
-            logging.error("failed to load dictionary: %s", exc)
+    for result in engine.load_dictionaries(dicts, workers=workers):
+        if result["error"] is None:
+            logging.info(
+                "dictionary %s: %s entries in %.3fs", result["filename"], result["entries"], result["seconds"]
+            )
 
     return engine
 
@@ -67,25 +161,131 @@ def talk_to_me(engine):
             print(say, "\n")
 
 
-def run_server(engine, server_params, limit=10**10):
+def run_batch(engine, infile, outfile, fmt="auto", field="text", workers=0, dicts=None):
     """
-    launch simple iterative TCP server (one client connection at a time)
-    and talk with someone from outside
+    read lines or JSONL records from input, parse them all
+    and write JSONL results (input, answer, entry, latency) in the input order
+    Args:
+        fmt (str): input format -- `lines`, `jsonl` or `auto` (JSON if line starts with `{`).
+        field (str): JSONL record field with the input phrase.
+        workers (int): parse in a pool of processes.
+        dicts (list): dictionaries to load in workers (if engine is not inherited).
     """
 
+    global BATCH_ENGINE  # pylint: disable=global-statement
+    BATCH_ENGINE = engine
+
+    records = (read_batch_record(line, fmt, field) for line in infile)
+
+    count = 0
+    started = time.perf_counter()
+
+    if workers > 0:
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+        ctx = multiprocessing.get_context(method)
+        with ctx.Pool(workers, initializer=init_batch_worker, initargs=(dicts,)) as pool:
+            for result in pool.imap(parse_batch_record, records, chunksize=BATCH_CHUNK_SIZE):
+                outfile.write(result)
+                count += 1
+    else:
+        for record in records:
+            outfile.write(parse_batch_record(record))
+            count += 1
+
+    outfile.flush()
+    elapsed = time.perf_counter() - started
+    logging.info("batch: %s records in %.3fs (%.1f/s)", count, elapsed, count / (elapsed or 1))
+
+
+def read_batch_record(line, fmt, field):
+    """get input phrase from line, returns (phrase, error)"""
+
+    line = line.rstrip("\r\n")
+    if fmt == "lines" or (fmt == "auto" and not line.lstrip().startswith("{")):
+        return (line, None)
+
+    try:
+        return (str(json.loads(line).get(field) or ""), None)
+    except Exception as exc:  # pylint: disable=broad-except
+        return ("", f"bad record: {exc}")
+
+
+def init_batch_worker(dicts):
+    """batch worker initializer: load dictionaries if engine was not inherited"""
+    global BATCH_ENGINE  # pylint: disable=global-statement
+    if BATCH_ENGINE is None:
+        BATCH_ENGINE = init_delta(dicts or [], workers=1)  # pool workers can not start their own pools
+
+
+def parse_batch_record(record):
+    """parse one phrase, returns JSONL result line"""
+
+    inline, error = record
+    result = {"input": inline}
+
+    if error is None:
+        started = time.perf_counter()
+        say, entry = BATCH_ENGINE.parse_entry(inline)
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        result["answer"] = say
+        result["entry"] = entry and str(entry)
+    else:
+        result["error"] = error
+
+    return json.dumps(result, ensure_ascii=False) + "\n"
+
+
+def save_profile(engine, filename=None, top=0):
+    """save profile stats (JSON) and log sorted report (stats of worker processes are not collected)"""
+
+    report = engine.profiler.report(engine.dictionary)
+
+    if top:
+        logging.info("profile:\n%s", delta.Profiler.format_report(report, top))
+
+    if filename:
+        with open(
+            sys.stdout.fileno() if filename == "-" else filename,
+            "w",
+            encoding="utf-8",
+            closefd=filename != "-",
+        ) as outfile:
+            json.dump(report, outfile, ensure_ascii=False, indent=1)
+            outfile.write("\n")
+
+
+def listen(server_params, reuseport=False):
+    """create listening TCP socket"""
+
     # create socket
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     # we need this for fast server restarting
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # many processes may listen on the same port
+    if reuseport:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
     # bind socket to address and port
     logging.info("server is listening at: %s", server_params)
     server.bind((server_params[0], int(server_params[1])))
-    server.listen(5)
+    server.listen(SERVER_BACKLOG)
+
+    return server
+
+
+def run_server(engine, server_params, limit=10**10, timeout=SERVER_READ_TIMEOUT, server=None):
+    """
+    launch simple iterative TCP server (one client connection at a time)
+    and talk with someone from outside,
+    returns True if `limit` clients are served
+    """
+
+    if server is None:
+        server = listen(server_params)
 
     try:
         while limit > 0:
-            handle_client(server, engine)
+            handle_client(server, engine, timeout)
             limit -= 1
     except KeyboardInterrupt:
         logging.info("exiting by request")
@@ -95,34 +295,263 @@ def run_server(engine, server_params, limit=10**10):
     # close listening socket
     server.close()
 
+    return limit <= 0
+
+
+def run_prefork_server(serve, server_params, workers, reuseport=False, on_fork=None):
+    """
+    launch pre-forked TCP server:
+    - dictionaries are loaded (and compiled) once in the parent process
+      and shared with forked workers copy-on-write,
+    - all workers accept connections on the same listening socket
+      (or on their own sockets bound to the same port with SO_REUSEPORT),
+    - parent process restarts workers which exited before serving their limit.
+    Args:
+        serve (callable): worker server function, gets listening socket as argument,
+            returns True if the worker served its limit (exits with 0, not restarted).
+        on_fork (callable, optional): called in a new worker with its slot number (0..workers-1).
+    """
+
+    server = None if reuseport else listen(server_params)
+
+    # move all loaded objects to permanent generation (keep memory pages shared)
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def _spawn(slot):
+        pid = os.fork()
+        if pid == 0:  # worker
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            code = 1
+            try:
+                logging.info("worker %s started", os.getpid())
+                if on_fork is not None:
+                    on_fork(slot)
+                if serve(server or listen(server_params, reuseport=True)):
+                    code = 0
+            except Exception as exc:  # pylint: disable=broad-except
+                logging.error("worker %s failed: %s", os.getpid(), exc)
+            os._exit(code)  # pylint: disable=protected-access
+        children[pid] = (time.monotonic(), slot)
+
+    def _stop(signum, _):
+        nonlocal stopping
+        logging.info("exiting by request (%s)", signum)
+        stopping = True
+        for pid in children:
+            with contextlib.suppress(ProcessLookupError):  # already dead
+                os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    for slot in range(workers):
+        _spawn(slot)
+
+    while children:
 
-def handle_client(server, engine):
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+
+        started, slot = children.pop(pid, (None, None))
+        if stopping or started is None:
+            continue
+
+        if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+            logging.info("worker %s finished", pid)
+            continue
+
+        logging.error("worker %s died (status=%s), restarting", pid, status)
+        if time.monotonic() - started < SERVER_RESPAWN_DELAY:  # do not respawn too fast
+            time.sleep(SERVER_RESPAWN_DELAY)
+        _spawn(slot)
+
+    if server is not None:
+        server.close()
+
+
+def handle_client(server, engine, timeout=SERVER_READ_TIMEOUT):
     """wait for client, read input, process, reply and then exit"""
 
     # wait here for the client (blocking call)
     client, client_address = server.accept()
     logging.info("server got new connection: %s", client_address)
+    if SERVER_METRICS is not None:
+        SERVER_METRICS.connections.inc()
 
-    # block again until data is posted or timeout occured
-    selset = select.select([client], [], [], SERVER_READ_TIMEOUT)
+    try:
+        # block again until data is posted or timeout occured
+        selset = select.select([client], [], [], timeout)
+
+        if len(selset[0]) == 0:  # nothing to read
+            logging.error("socket reading timeout (%ss)", timeout)
+            if SERVER_METRICS is not None:
+                SERVER_METRICS.errors["timeout"].inc()
+
+        else:  # got something to read -- read and process
+
+            data = client.recv(SERVER_INPUT_MAXSIZE)
+
+            inline = clean_input(data)
+            logging.info("> %s", inline)
+
+            if inline:
+                say, seconds = parse_timed(engine, inline)
+                client.sendall(bytes(say + "\r\n", encoding="utf-8", errors="ignore"))
+                logging.info("< %s", say)
+                if SERVER_METRICS is not None:
+                    SERVER_METRICS.parsed(seconds)
+
+    except OSError as exc:  # client reset connection, etc. -- keep serving others
+        logging.error("connection error: %s", exc)
+        if SERVER_METRICS is not None:
+            SERVER_METRICS.errors["connection"].inc()
+
+    finally:
+        client.close()
+
+
+def run_async_server(
+    engine,
+    server_params,
+    limit=10**10,
+    max_connections=SERVER_MAX_CONNECTIONS,
+    timeout=SERVER_READ_TIMEOUT,
+    persistent=False,
+    server=None,
+):
+    """
+    launch asyncio TCP server (many client connections at a time)
+    and talk with everyone from outside,
+    returns True if `limit` clients are served
+    """
 
-    if len(selset[0]) == 0:  # nothing to read
-        logging.error("socket reading timeout (%ss)", SERVER_READ_TIMEOUT)
+    try:
+        asyncio.run(serve_async(engine, server_params, limit, max_connections, timeout, persistent, server))
+        return True
+    except KeyboardInterrupt:
+        logging.info("exiting by request")
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.error("something bad happened: %s", exc)
 
-    else:  # got something to read -- read and process
+    return False
 
-        data = client.recv(SERVER_INPUT_MAXSIZE)
 
-        inline = data.decode("utf-8", errors="ignore")
-        inline = re.sub(r"[ \r\t\n]+", " ", inline).strip()
-        logging.info("> %s", inline)
+async def serve_async(engine, server_params, limit, max_connections, timeout, persistent, server=None):
+    """
+    accept connections until `limit` clients are served:
+    - no more than `max_connections` clients at a time (others are rejected),
+    - delta parser is called in a thread pool, so the event loop keeps accepting
+    """
 
-        if inline:
-            say = engine.parse(inline)
-            client.sendall(bytes(say + "\r\n", encoding="utf-8", errors="ignore"))
-            logging.info("< %s", say)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=SERVER_PARSE_THREADS)
+    served = asyncio.Event()
+    state = {"active": 0, "served": 0}
+
+    async def _handle(reader, writer):
+
+        if state["active"] >= max_connections:
+            logging.error("too many connections (%s), rejected", state["active"])
+            if SERVER_METRICS is not None:
+                SERVER_METRICS.errors["rejected"].inc()
+            writer.close()
+            return
+
+        state["active"] += 1
+        if SERVER_METRICS is not None:
+            SERVER_METRICS.connections.inc()
+            SERVER_METRICS.active.inc()
+        try:
+            await handle_client_async(engine, reader, writer, executor, timeout, persistent)
+        finally:
+            state["active"] -= 1
+            if SERVER_METRICS is not None:
+                SERVER_METRICS.active.inc(-1)
+            state["served"] += 1
+            if state["served"] >= limit:
+                served.set()
+
+    if server is None:
+        server = listen(server_params)
+
+    aserver = await asyncio.start_server(_handle, sock=server, limit=SERVER_INPUT_MAXSIZE)
+
+    async with aserver:
+        await served.wait()
+
+    executor.shutdown(wait=False)
+
+
+async def handle_client_async(engine, reader, writer, executor, timeout, persistent):
+    """
+    read input, process, reply and then exit;
+    in persistent mode reply to every line until client closes connection or timeout occured
+    """
 
-    client.close()
+    logging.info("server got new connection: %s", writer.get_extra_info("peername"))
+    loop = asyncio.get_running_loop()
+
+    try:
+        while True:
+
+            try:
+                if persistent:
+                    data = await asyncio.wait_for(reader.readline(), timeout)
+                else:
+                    data = await asyncio.wait_for(reader.read(SERVER_INPUT_MAXSIZE), timeout)
+            except asyncio.TimeoutError:  # not builtin TimeoutError before python 3.11
+                logging.error("socket reading timeout (%ss)", timeout)
+                if SERVER_METRICS is not None:
+                    SERVER_METRICS.errors["timeout"].inc()
+                break
+            except ValueError:  # line is longer than SERVER_INPUT_MAXSIZE
+                logging.error("input is too long")
+                if SERVER_METRICS is not None:
+                    SERVER_METRICS.errors["too_long"].inc()
+                break
+
+            if not data:  # connection closed
+                break
+
+            inline = clean_input(data)
+            logging.info("> %s", inline)
+
+            if inline:
+                say, seconds = await loop.run_in_executor(executor, parse_timed, engine, inline)
+                writer.write(bytes(say + "\r\n", encoding="utf-8", errors="ignore"))
+                await writer.drain()
+                logging.info("< %s", say)
+                if SERVER_METRICS is not None:
+                    SERVER_METRICS.parsed(seconds)
+
+            if not persistent:
+                break
+
+    except ConnectionError as exc:
+        logging.error("connection error: %s", exc)
+        if SERVER_METRICS is not None:
+            SERVER_METRICS.errors["connection"].inc()
+
+    finally:
+        writer.close()
+
+
+def parse_timed(engine, inline):
+    """parse input line, returns answer and parse time (seconds)"""
+    started = time.perf_counter()
+    say = engine.parse(inline)
+    return say, time.perf_counter() - started
+
+
+def clean_input(data):
+    """decode client input and clean up spaces"""
+    inline = data.decode("utf-8", errors="ignore")
+    return re.sub(r"[ \r\t\n]+", " ", inline).strip()
 
 
 def main():
@@ -144,6 +573,103 @@ def main():
         "--tcpserver", "-t", nargs=2, metavar=("HOST", "PORT"), help="start simple TCP server"
     )
     parser.add_argument("--tcpserver-limit", type=int, default=10**10)
+    parser.add_argument(
+        "--tcpserver-async", action="store_true", default=False, help="serve many clients at a time"
+    )
+    parser.add_argument(
+        "--tcpserver-max-connections",
+        type=int,
+        default=SERVER_MAX_CONNECTIONS,
+        help="async server: max concurrent connections",
+    )
+    parser.add_argument(
+        "--tcpserver-timeout", type=float, default=SERVER_READ_TIMEOUT, help="client read timeout (seconds)"
+    )
+    parser.add_argument(
+        "--tcpserver-persistent",
+        action="store_true",
+        default=False,
+        help="async server: keep connection open and reply to every line",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=0, help="TCP server: number of pre-forked worker processes"
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs=2,
+        metavar=("HOST", "PORT"),
+        help="TCP server: serve Prometheus metrics at http://HOST:PORT/metrics",
+    )
+    parser.add_argument(
+        "--reuseport",
+        action="store_true",
+        default=False,
+        help="TCP server: workers listen with SO_REUSEPORT (instead of shared socket)",
+    )
+    parser.add_argument(
+        "--batch", metavar="FILE", help="parse all lines (or JSONL records) from file (`-` for stdin)"
+    )
+    parser.add_argument(
+        "--batch-format", choices=["auto", "lines", "jsonl"], default="auto", help="batch input format"
+    )
+    parser.add_argument("--batch-field", default="text", help="batch JSONL records field with input phrase")
+    parser.add_argument("--batch-output", metavar="FILE", help="batch results file (default: stdout)")
+    parser.add_argument("--batch-workers", type=int, default=0, help="batch: number of worker processes")
+    parser.add_argument(
+        "--cache", action="store_true", default=False, help="use precompiled dictionary cache files"
+    )
+    parser.add_argument(
+        "--load-workers",
+        type=int,
+        default=0,
+        metavar="N",
+        help="processes loading dictionaries (0 -- CPU count)",
+    )
+    parser.add_argument(
+        "--lookup-cache", type=int, default=0, metavar="SIZE", help="LRU lookup cache size (0 -- disabled)"
+    )
+    parser.add_argument(
+        "--lazy-compile", action="store_true", default=False, help="compile patterns on the first use"
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="save per entry and per pattern lookup stats on exit (JSON, `-` for stdout)",
+    )
+    parser.add_argument(
+        "--profile-report",
+        type=int,
+        default=0,
+        metavar="TOP",
+        help="log sorted profile report on exit (TOP entries, patterns and macros)",
+    )
+    parser.add_argument(
+        "--warm-up", action="store_true", default=False, help="compile patterns in background (lazy mode)"
+    )
+    parser.add_argument(
+        "--input-maxsize",
+        type=int,
+        default=SERVER_INPUT_MAXSIZE,
+        metavar="CHARS",
+        help="input is truncated before matching (0 -- no limit)",
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help="time limit for one input, empty answer if exceeded (0 -- unlimited)",
+    )
+    parser.add_argument(
+        "--step-budget",
+        type=int,
+        default=0,
+        metavar="N",
+        help="regexps evaluated and macros expanded for one input (0 -- unlimited)",
+    )
+    parser.add_argument(
+        "--build-cache", action="store_true", default=False, help="(re)build dictionary cache files and exit"
+    )
     parser.add_argument("dictionary", nargs="+", help="load XML dictionary")
     args = parser.parse_args()
 
@@ -153,13 +679,89 @@ def main():
         delta.DEBUG = True
 
     delta.SHELL_ALLOWED = bool(args.allow_shell)
+    delta.Delta.DICTIONARY_CACHE = bool(args.cache or args.build_cache)
+    delta.Dictionary.lazy_compile = bool(args.lazy_compile)
+    delta.Delta.LOOKUP_CACHE_SIZE = args.lookup_cache
+    delta.Delta.LOAD_WORKERS = args.load_workers
+    delta.Delta.PROFILE = bool(args.profile or args.profile_report)
+    delta.Delta.INPUT_MAXSIZE = args.input_maxsize
+    delta.Delta.TIME_BUDGET = args.time_budget
+    delta.Delta.STEP_BUDGET = args.step_budget
 
     # create engine and load dictionaries
+    started = time.perf_counter()
     delta_engine = init_delta(args.dictionary)
-
-    if args.tcpserver:
-        # start simple TCP server
-        run_server(delta_engine, args.tcpserver, args.tcpserver_limit)
+    load_seconds = time.perf_counter() - started
+    if args.verbose:
+        logging.info("dictionary memory: %s", delta_engine.dictionary.memory_report())
+
+    if args.build_cache:
+        # cache files are saved by loader
+        logging.info("dictionary cache ready: %s entries", len(delta_engine.dictionary))
+    elif args.tcpserver:
+        if args.metrics:
+            global SERVER_METRICS  # pylint: disable=global-statement
+            SERVER_METRICS = ServerMetrics(delta_engine, load_seconds)
+            if args.workers > 0:
+                SERVER_METRICS.registry.share(args.workers)
+            serve_metrics(SERVER_METRICS.registry, args.metrics)
+        if args.tcpserver_async:
+            # asyncio TCP server
+            serve = functools.partial(
+                run_async_server,
+                delta_engine,
+                args.tcpserver,
+                args.tcpserver_limit,
+                max_connections=args.tcpserver_max_connections,
+                timeout=args.tcpserver_timeout,
+                persistent=args.tcpserver_persistent,
+            )
+        else:
+            # simple TCP server
+            serve = functools.partial(
+                run_server, delta_engine, args.tcpserver, args.tcpserver_limit, args.tcpserver_timeout
+            )
+        if args.workers > 0:
+            # compile everything before fork
+            delta_engine.warm_up()
+            run_prefork_server(
+                lambda server: serve(server=server),
+                args.tcpserver,
+                args.workers,
+                args.reuseport,
+                on_fork=SERVER_METRICS and SERVER_METRICS.registry.attach,
+            )
+        else:
+            if args.warm_up:
+                delta_engine.warm_up(background=True)
+            serve()
+    elif args.batch:
+        # batch mode
+        with (
+            open(
+                sys.stdin.fileno() if args.batch == "-" else args.batch,
+                encoding="utf-8",
+                errors="replace",
+                buffering=BATCH_BUFFER_SIZE,
+                closefd=args.batch != "-",
+            ) as infile,
+            open(
+                args.batch_output or sys.stdout.fileno(),
+                "w",
+                encoding="utf-8",
+                buffering=BATCH_BUFFER_SIZE,
+                closefd=bool(args.batch_output),
+            ) as outfile,
+        ):
+            run_batch(
+                delta_engine,
+                infile,
+                outfile,
+                fmt=args.batch_format,
+                field=args.batch_field,
+                workers=args.batch_workers,
+                dicts=args.dictionary,
+            )
     elif args.say:
         # one timer from commandline
         say_to_me(delta_engine, args.say[0], print_in_out=(args.debug or args.verbose))
@@ -167,6 +769,12 @@ def main():
         # start dialog from console
         talk_to_me(delta_engine)
 
+    if delta_engine.cache is not None:
+        logging.info("lookup cache: %s", delta_engine.cache.stats())
+
+    if delta_engine.profiler is not None:
+        save_profile(delta_engine, args.profile, args.profile_report)
+
 
 if __name__ == "__main__":
     main()
@@ -3,20 +3,24 @@ delta telegram demo bot
 """
 
 import argparse
+import asyncio
 import concurrent.futures
-import json
+import gc
 import logging
+import multiprocessing
 import os
 import random
+import signal
 import sys
 import time
 
-import requests
+import aiohttp
 from aiohttp import web
 
-from delta import delta
+from delta import delta, metrics
 
 TG_API_URL = "https://api.telegram.org/bot{token}/{cmd}"
+TG_INPUT_MAXSIZE = 4096  # telegram message length limit
 
 
 def setup_logger(debug=False):
@@ -29,17 +33,133 @@ def setup_logger(debug=False):
     return logging.getLogger("delta")
 
 
+def configure(settings):
+    """set up logging and engine knobs (in the main process and in spawned workers)"""
+
+    delta.logger = setup_logger(settings["debug"])
+    if settings["debug"] or settings["verbose"]:
+        delta.DEBUG = True
+
+    delta.SHELL_ALLOWED = False
+    delta.Delta.DICTIONARY_CACHE = settings["cache"]
+    delta.Delta.LOAD_WORKERS = settings["load_workers"]
+    delta.Dictionary.lazy_compile = settings["lazy_compile"]
+    delta.Delta.LOOKUP_CACHE_SIZE = settings["lookup_cache"]
+    delta.Delta.INPUT_MAXSIZE = settings["input_maxsize"]
+    delta.Delta.TIME_BUDGET = settings["time_budget"]
+    delta.Delta.STEP_BUDGET = settings["step_budget"]
+    DeltaTG.WORKER_SLEEP_TIME = settings["workers_sleep_time"]
+
+
+def memory_usage():
+    """current process memory: (rss, private) in kB, private pages are not shared with the parent"""
+
+    rss = private = None
+    try:
+        with open("/proc/self/smaps_rollup", encoding="ascii") as smaps:
+            for line in smaps:
+                key, value = line.split(":", 1)
+                if key == "Rss":
+                    rss = int(value.split()[0])
+                elif key in ("Private_Clean", "Private_Dirty"):
+                    private = (private or 0) + int(value.split()[0])
+    except (OSError, ValueError):
+        pass
+
+    return rss, private
+
+
+class TGSender:
+    """
+    TGSender -- telegram API client (lives in the aiohttp process)
+        + one pooled keep-alive HTTP session
+        + bounded number of concurrent requests
+        + retries with backoff on 429 and 5xx responses
+        + send latency and errors metrics
+    """
+
+    MAX_CONCURRENCY = 16
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 0.5  # seconds, doubled on every retry
+    TIMEOUT = 10
+
+    def __init__(self, token, api_url=TG_API_URL, registry=None):
+        self.token = token
+        self.api_url = api_url
+        self.session = None
+        self.slots = None
+
+        registry = registry if registry is not None else metrics.Registry()
+        self.send_seconds = registry.histogram("delta_send_seconds", "telegram API request latency (seconds)")
+        self.send_errors = registry.counter("delta_send_errors_total", "failed telegram API requests")
+        self.send_retries = registry.counter("delta_send_retries_total", "telegram API requests retried")
+        self.sent = {
+            result: registry.counter("delta_sent_total", "messages posted to telegram", {"result": result})
+            for result in ("ok", "rejected", "failed")
+        }
+
+    async def start(self, _app=None):
+        """create HTTP session (aiohttp startup hook)"""
+        self.slots = asyncio.Semaphore(self.MAX_CONCURRENCY)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.MAX_CONCURRENCY),
+            timeout=aiohttp.ClientTimeout(total=self.TIMEOUT),
+        )
+
+    async def close(self, _app=None):
+        """close HTTP session (aiohttp cleanup hook)"""
+        if self.session is not None:
+            await self.session.close()
+
+    async def send_message(self, chat_id, text):
+        """send a message via telegram API, returns True if sent"""
+
+        data = {"chat_id": chat_id, "text": text[:4096], "parse_mode": "Markdown"}  # TG API limit
+
+        url = self.api_url.format(token=self.token, cmd="sendMessage")
+
+        async with self.slots:
+            for attempt in range(self.MAX_RETRIES + 1):
+
+                delay = self.RETRY_BACKOFF * 2**attempt
+                started = time.perf_counter()
+                try:
+                    async with self.session.post(url, json=data) as rsp:
+                        body = await rsp.text()
+                        self.send_seconds.observe(time.perf_counter() - started)
+                        if rsp.status != 429 and rsp.status < 500:
+                            logging.info("message sent to=%s: [%s] %.80s", chat_id, rsp.status, body)
+                            self.sent["ok" if rsp.status == 200 else "rejected"].inc()
+                            return rsp.status == 200
+                        logging.error("sending failed (to=%s): [%s] %.80s", chat_id, rsp.status, body)
+                        if rsp.status == 429:  # too many requests -- wait as told
+                            rsp_data = await rsp.json(content_type=None)
+                            delay = rsp_data.get("parameters", {}).get("retry_after", delay)
+                except Exception as exc:  # pylint: disable=broad-except
+                    logging.error("sending failed (to=%s): %s", chat_id, exc)
+
+                self.send_errors.inc()
+                if attempt < self.MAX_RETRIES:
+                    self.send_retries.inc()
+                    await asyncio.sleep(delay)
+
+        logging.error("failed (to=%s text=`%.40s`): no more retries", chat_id, text)
+        self.sent["failed"].inc()
+        return False
+
+
 class DeltaTG:
     """
     DeltaTG -- simple telegram bot interface
         + async webhook
         + sync parser (multiprocess via ProcessPoolExecutor queue)
+        + async sender (replies are posted from the aiohttp process)
+        + hot reload of dictionaries (SIGHUP, file watch or admin endpoint)
+        + Prometheus metrics (workers send their stats back with every answer)
     """
 
-    # Note: one delta engine and one set of API keys
-    # for all class instances -- in all subprocesses!
+    # Note: one delta engine for all class instances -- in all subprocesses!
     engine = None
-    token = None
 
     # templates for instant replies
     START_INPUT = "/start"
@@ -47,11 +167,94 @@ class DeltaTG:
 
     WORKER_SLEEP_TIME = 0
 
-    def __init__(self, dicts, token, executor):
+    # seconds the pool worker spent in its initializer
+    worker_startup = None
+
+    # how long webhook waits for delta answer to reply inline (0 -- never)
+    INLINE_REPLY_TIMEOUT = 0.5
+
+    # backpressure: messages being answered at once, and what to do with the rest
+    #   reject -- HTTP 429, telegram will deliver the message again later
+    #   drop   -- accept the message and never answer it
+    #   quick  -- answer with one of BUSY_REPLY
+    MAX_IN_FLIGHT = 100
+    OVERFLOW_POLICIES = ("reject", "drop", "quick")
+    OVERFLOW_POLICY = "reject"
+    BUSY_REPLY = ["Wait a minute, please...", "Погоди минутку..."]
+
+    def __init__(self, token, dicts, settings, workers, api_url=TG_API_URL):
         self.counter = 0
-        self.executor = executor
-        self.init_delta(dicts)
-        DeltaTG.token = token
+        self.dicts = dicts
+        self.settings = settings
+        self.workers = workers
+        self.executor = None  # pool of workers (see `start_pool`)
+        self.reloading = False
+        self.metrics = metrics.Registry()
+        self.sender = TGSender(token, api_url, self.metrics)
+        self.tasks = set()  # running reply tasks
+        self.chats = {}  # chat_id -> last reply task (answer messages in order)
+        self.stats = {
+            "accepted": 0,
+            "overflow": 0,
+            "failed": 0,
+            "inline": 0,
+            "later": 0,
+            "in_flight": 0,
+            "in_flight_max": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+            "reloads": 0,
+            "reloads_failed": 0,
+        }
+        self.load_seconds = 0.0  # dictionaries load time
+        self.worker_stats = {}  # pid -> lookup cache (hits, misses) of the pool worker
+        self.worker_exceeded = {}  # pid -> messages aborted by budget (by cause) in the pool worker
+        self.init_metrics()
+
+    def init_metrics(self):
+        """register metrics, counters are read from `stats` on scrape (nothing extra on the hot path)"""
+
+        registry, stats = self.metrics, self.stats
+
+        def _stat(key):
+            return lambda: stats[key]
+
+        def _cache(num):
+            return lambda: sum(cache[num] for cache in self.worker_stats.values())
+
+        def _exceeded(cause):
+            return lambda: sum(x.get(cause, 0) for x in self.worker_exceeded.values())
+
+        registry.counter("delta_webhook_requests_total", "webhook requests", func=lambda: self.counter)
+        for status in ("accepted", "overflow", "failed"):
+            registry.counter("delta_messages_total", "messages for delta", {"status": status}, _stat(status))
+        for way in ("inline", "later"):
+            registry.counter("delta_answers_total", "answers sent", {"way": way}, _stat(way))
+        registry.counter("delta_reloads_total", "dictionary reloads", {"result": "ok"}, _stat("reloads"))
+        registry.counter(
+            "delta_reloads_total", "dictionary reloads", {"result": "failed"}, _stat("reloads_failed")
+        )
+        registry.gauge(
+            "delta_executor_queue_depth", "messages queued or being answered", func=_stat("in_flight")
+        )
+        registry.gauge("delta_executor_queue_depth_max", "max queue depth", func=_stat("in_flight_max"))
+        registry.gauge("delta_chats", "chats with unanswered messages", func=lambda: len(self.chats))
+        self.wait_seconds = registry.histogram("delta_queue_wait_seconds", "executor queue wait (seconds)")
+        self.parse_seconds = registry.histogram("delta_parse_seconds", "parse latency in workers (seconds)")
+        registry.counter("delta_lookup_cache_hits_total", "lookup cache hits (workers)", func=_cache(0))
+        registry.counter("delta_lookup_cache_misses_total", "lookup cache misses (workers)", func=_cache(1))
+        for cause in ("time", "steps"):
+            registry.counter(
+                "delta_budget_exceeded_total", "messages over budget", {"cause": cause}, _exceeded(cause)
+            )
+        registry.gauge(
+            "delta_dictionary_entries",
+            "dictionary entries",
+            func=lambda: len(DeltaTG.engine.dictionary) if DeltaTG.engine is not None else 0,
+        )
+        registry.gauge(
+            "delta_dictionary_load_seconds", "dictionaries load time", func=lambda: self.load_seconds
+        )
 
     async def webhook(self, request):
         """
@@ -91,10 +294,121 @@ class DeltaTG:
 
         # add a task for delta engine subprocess
         if not reply:
-            self.executor.submit(DeltaTG.ask_delta, i, text, chat_id)
+            reply = await self.ask_delta_inline(i, text, chat_id)
 
         return web.json_response(reply or {})
 
+    async def ask_delta_inline(self, idx, text, chat_id):
+        """
+        ask delta engine subprocess for answer:
+            - fast answers are returned as webhook reply
+            - slow ones are posted to chat later
+            - on overflow the message is rejected, dropped or answered quickly
+        """
+
+        if self.stats["in_flight"] >= self.MAX_IN_FLIGHT:
+            self.stats["overflow"] += 1
+            logging.warning("(%s) overflow: %s in flight, %s", idx, self.MAX_IN_FLIGHT, self.OVERFLOW_POLICY)
+            if self.OVERFLOW_POLICY == "reject":
+                raise web.HTTPTooManyRequests()
+            if self.OVERFLOW_POLICY == "quick":
+                return self.make_reply(chat_id, random.choice(self.BUSY_REPLY))
+            return {}
+
+        self.stats["accepted"] += 1
+        self.stats["in_flight"] += 1
+        self.stats["in_flight_max"] = max(self.stats["in_flight_max"], self.stats["in_flight"])
+
+        # messages from one chat are answered in order
+        prev = self.chats.get(chat_id)
+
+        inline = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(self.reply(idx, text, chat_id, prev, inline))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+        self.chats[chat_id] = task
+        task.add_done_callback(lambda _: self.chat_done(chat_id, task))
+
+        if self.INLINE_REPLY_TIMEOUT > 0:
+            try:
+                say = await asyncio.wait_for(inline, self.INLINE_REPLY_TIMEOUT)
+            except asyncio.TimeoutError:  # not builtin TimeoutError before python 3.11
+                logging.info("(%s) no answer in %ss, reply later", idx, self.INLINE_REPLY_TIMEOUT)
+            else:
+                return self.make_reply(chat_id, say) if say is not None else {}
+        else:
+            inline.cancel()
+
+        return {}
+
+    async def reply(self, idx, text, chat_id, prev, inline):
+        """
+        wait for previous message from the chat (`prev` task), ask delta engine subprocess,
+        then pass the answer to webhook (`inline` future) or post it to chat
+        """
+
+        queued = time.time()
+        say = None
+
+        try:
+            if prev is not None:
+                await asyncio.wait([prev])
+
+            loop = asyncio.get_running_loop()
+            say, wait, (pid, seconds, cache, exceeded) = await loop.run_in_executor(
+                self.executor, DeltaTG.ask_delta, idx, text, chat_id, queued
+            )
+
+            self.stats["wait_total"] += wait
+            self.stats["wait_max"] = max(self.stats["wait_max"], wait)
+            self.wait_seconds.observe(wait)
+            self.parse_seconds.observe(seconds)
+            if cache is not None:
+                self.worker_stats[pid] = cache
+            self.worker_exceeded[pid] = exceeded
+        except Exception as exc:  # pylint: disable=broad-except
+            self.stats["failed"] += 1
+            logging.error("(%s) delta failed: %s", idx, exc)
+        finally:
+            self.stats["in_flight"] -= 1
+
+        if not inline.done():
+            self.stats["inline"] += 1
+            inline.set_result(say)
+        elif say is not None:
+            self.stats["later"] += 1
+            await self.sender.send_message(chat_id, say)
+
+    def chat_done(self, chat_id, task):
+        """forget the chat if its last message is answered"""
+        if self.chats.get(chat_id) is task:
+            del self.chats[chat_id]
+
+    @staticmethod
+    def make_reply(chat_id, text):
+        """webhook reply data"""
+        return {"method": "sendMessage", "chat_id": chat_id, "text": text[:4096], "parse_mode": "Markdown"}
+
+    async def stats_handler(self, _request):
+        """report queue stats"""
+
+        stats = dict(self.stats)
+        stats["chats"] = len(self.chats)
+        stats["wait_avg"] = stats["wait_total"] / (stats["accepted"] or 1)
+
+        return web.json_response(stats)
+
+    async def metrics_handler(self, _request):
+        """report metrics (Prometheus text format)"""
+        return web.Response(
+            body=self.metrics.render().encode("utf-8"), headers={"Content-Type": metrics.CONTENT_TYPE}
+        )
+
+    async def log_stats(self, _app=None):
+        """log queue stats (aiohttp cleanup hook)"""
+        logging.info("queue stats: %s", self.stats)
+
     def try_quick_reply(self, text, from_name, from_username, chat_id):
         """
         use instant reply templates for /start commands and empty texts
@@ -109,52 +423,277 @@ class DeltaTG:
 
         return {}
 
-    def init_delta(self, dicts):
-        """ " create delta instance and load dictionaries"""
+    @staticmethod
+    def init_delta(dicts, workers=None):
+        """create delta instance and load dictionaries (in parallel, errors are logged by the engine)"""
 
-        logging.info("init delta (%s): %s", id(self), dicts)
+        logging.info("init delta: %s", dicts)
 
         # note: static class attribute -- single instance for all
         DeltaTG.engine = delta.Delta()
 
-        for dct in dicts:
-            try:
-                DeltaTG.engine.load_dictionary(dct)
-            except Exception as exc:  # pylint: disable=broad-except
-                logging.error("failed to load dictionary: %s", exc)
+        for result in DeltaTG.engine.load_dictionaries(dicts, workers=workers):
+            if result["error"] is None:
+                logging.info(
+                    "dictionary %s: %s entries in %.3fs",
+                    result["filename"],
+                    result["entries"],
+                    result["seconds"],
+                )
 
     @staticmethod
-    def ask_delta(idx, text, chat_id):
-        """ask delta for answer"""
-
-        logging.info("(%s) %s> %.150s", idx, chat_id, text)
+    def init_worker(dicts, settings):
+        """
+        pool worker initializer:
+            - forked worker inherits the engine loaded by the parent (pages are shared copy-on-write)
+            - spawned worker sets the same knobs and loads dictionaries itself
+        """
 
-        if DeltaTG.WORKER_SLEEP_TIME:  # dev mode
-            time.sleep(DeltaTG.WORKER_SLEEP_TIME)
+        started = time.perf_counter()
 
-        # call delta parser
-        say = DeltaTG.engine.parse(text)
+        # Ctrl+C goes to the parent process, it shuts the pool down
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-        logging.info("(%s) %s< %.150s", idx, chat_id, say)
+        if DeltaTG.engine is None:
+            configure(settings)
+            DeltaTG.init_delta(dicts, workers=1)  # pool workers can not start their own pools
+            if settings["warm_up"]:
+                DeltaTG.engine.warm_up()
 
-        # post a reply to chat
-        DeltaTG.send_tg_message(chat_id, say)
+        DeltaTG.worker_startup = time.perf_counter() - started
 
     @staticmethod
-    def send_tg_message(chat_id, text):
-        """send a message via telegram API"""
+    def worker_info(delay=0):
+        """worker state for the startup check (`delay` keeps this worker busy so others get the rest)"""
 
-        data = {"chat_id": chat_id, "text": text[:4096], "parse_mode": "Markdown"}  # TG API limit
+        time.sleep(delay)
+
+        engine = DeltaTG.engine
+        rss, private = memory_usage()
+
+        return {
+            "pid": os.getpid(),
+            "entries": len(engine.dictionary) if engine is not None else None,
+            "startup": DeltaTG.worker_startup,
+            "rss": rss,
+            "private": private,
+        }
+
+    def fork_pool(self):
+        """
+        fork pool of workers sharing the engine loaded by this process,
+        returns the pool and futures of workers checks (see `check_workers`)
+        """
+
+        # move loaded objects to permanent generation (gc won't touch them, memory pages stay shared)
+        gc.collect()
+        gc.freeze()
+
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(method),
+            initializer=DeltaTG.init_worker,
+            initargs=(self.dicts, self.settings),
+        )
+
+        # all workers are forked by the first submit (in this thread)
+        try:
+            futures = [executor.submit(DeltaTG.worker_info, 0.1) for _ in range(self.workers)]
+        except Exception:
+            executor.shutdown(wait=False)
+            raise
+
+        return executor, futures
+
+    def start_pool(self):
+        """fork pool of workers, returns the pool when all workers are ready"""
+
+        executor, futures = self.fork_pool()
+
+        try:
+            DeltaTG.check_workers(futures, self.workers)
+        except Exception:
+            executor.shutdown(wait=False)
+            raise
+
+        return executor
+
+    def load_engine(self):
+        """
+        load dictionaries again into a new dictionary (the engine keeps using the old one),
+        raises if any of them fails to load
+        """
+
+        started = time.perf_counter()
+
+        # no process pool forked from this thread
+        dictionary = DeltaTG.engine.load_new_dictionary(self.dicts, workers=1)
+        if self.settings["warm_up"]:
+            DeltaTG.engine.warm_up(dictionary=dictionary)
+        self.load_seconds = time.perf_counter() - started
+        logging.info("engine reloaded in %.3fs", self.load_seconds)
+
+        return dictionary
+
+    async def swap_engine(self, dictionary):
+        """
+        start a new pool of workers forked with the new dictionary
+        and swap it in when all workers are ready (the old dictionary stays if they fail);
+        workers are forked from the event loop thread (no fork while other threads may hold locks),
+        but the loop is not blocked while they start
+        """
 
-        headers = {"Content-Type": "application/json"}
+        engine = DeltaTG.engine
+        old, engine.dictionary = engine.dictionary, dictionary
 
-        url = TG_API_URL.format(token=DeltaTG.token, cmd="sendMessage")
+        # let gc free the old dictionary
+        gc.unfreeze()
 
         try:
-            rsp = requests.post(url=url, headers=headers, data=json.dumps(data))
-            logging.info("message sent to=%s: [%s] %.80s", chat_id, rsp.status_code, rsp.text)
+            executor, futures = self.fork_pool()
+        finally:
+            engine.dictionary = old  # forked workers have the new one
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, DeltaTG.check_workers, futures, self.workers
+            )
+        except Exception:
+            executor.shutdown(wait=False)
+            raise
+
+        engine.dictionary = dictionary
+        return executor
+
+    async def reload(self, reason=""):
+        """
+        hot reload: new dictionaries and new pool are prepared in background,
+        messages already sent to the old pool are answered by old workers
+        """
+
+        if self.reloading:
+            logging.warning("reload (%s) skipped: already reloading", reason)
+            return False
+
+        logging.info("reload (%s): %s", reason, self.dicts)
+
+        self.reloading = True
+        try:
+            dictionary = await asyncio.get_running_loop().run_in_executor(None, self.load_engine)
+            executor = await self.swap_engine(dictionary)
         except Exception as exc:  # pylint: disable=broad-except
-            logging.error("failed (to=%s text=`%.40s`): %s", chat_id, text, exc)
+            self.stats["reloads_failed"] += 1
+            logging.error("reload failed, old dictionaries are kept: %s", exc)
+            return False
+        finally:
+            self.reloading = False
+
+        old, self.executor = self.executor, executor
+        old.shutdown(wait=False)
+        self.stats["reloads"] += 1
+
+        return True
+
+    async def reload_handler(self, _request):
+        """admin endpoint: reload dictionaries"""
+
+        reloaded = await self.reload("admin")
+
+        return web.json_response(
+            {"reloaded": reloaded, "entries": len(DeltaTG.engine.dictionary)},
+            status=200 if reloaded else 500,
+        )
+
+    def reload_later(self, reason):
+        """start reload in background"""
+        task = asyncio.create_task(self.reload(reason))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def watch(self, interval):
+        """reload when any of dictionary files is changed (polled every `interval` seconds)"""
+
+        def _mtimes():
+            mtimes = []
+            for filename in self.dicts:
+                try:
+                    mtimes.append(os.stat(filename).st_mtime_ns)
+                except OSError:
+                    mtimes.append(None)
+            return mtimes
+
+        mtimes = _mtimes()
+        while True:
+            await asyncio.sleep(interval)
+            if _mtimes() != mtimes:
+                mtimes = _mtimes()
+                await self.reload("file changed")
+
+    async def start_reload_triggers(self, app):
+        """set up SIGHUP handler and file watch (aiohttp startup hook)"""
+
+        if hasattr(signal, "SIGHUP"):
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, self.reload_later, "SIGHUP")
+
+        if self.settings["watch"] > 0:
+            app["watch"] = asyncio.create_task(self.watch(self.settings["watch"]))
+
+    @staticmethod
+    async def stop_reload_triggers(app):
+        """stop file watch (aiohttp cleanup hook)"""
+        if "watch" in app:
+            app["watch"].cancel()
+
+    @staticmethod
+    def check_workers(futures, count):
+        """wait for all pool workers and make sure each of them has a ready engine"""
+
+        started = time.perf_counter()
+
+        workers = {info["pid"]: info for info in (future.result() for future in futures)}
+
+        for info in workers.values():
+            logging.info(
+                "worker %s: %s entries, started in %.3fs, rss %s kB (private %s kB)",
+                info["pid"],
+                info["entries"],
+                info["startup"] or 0,
+                info["rss"],
+                info["private"],
+            )
+
+        if any(not info["entries"] for info in workers.values()):
+            raise RuntimeError("worker without dictionary")
+        if len(workers) < count:
+            logging.warning("only %s of %s workers checked", len(workers), count)
+
+        logging.info("%s workers ready in %.3fs", len(workers), time.perf_counter() - started)
+
+    @staticmethod
+    def ask_delta(idx, text, chat_id, queued=None):
+        """
+        ask delta for answer, returns answer, seconds spent in queue and worker stats:
+        (pid, parse seconds, lookup cache (hits, misses) or None, messages over budget by cause)
+        """
+
+        wait = time.time() - queued if queued else 0.0
+
+        logging.info("(%s) %s> %.150s", idx, chat_id, text)
+
+        if DeltaTG.WORKER_SLEEP_TIME:  # dev mode
+            time.sleep(DeltaTG.WORKER_SLEEP_TIME)
+
+        # call delta parser
+        started = time.perf_counter()
+        say = DeltaTG.engine.parse(text)
+        seconds = time.perf_counter() - started
+
+        logging.info("(%s) %s< %.150s", idx, chat_id, say)
+
+        cache = DeltaTG.engine.cache
+        stats = (os.getpid(), seconds, cache and (cache.hits, cache.misses), dict(DeltaTG.engine.exceeded))
+        return say, wait, stats
 
 
 def main():
@@ -174,7 +713,53 @@ def main():
         default=os.environ.get("DELTATG_API_TOKEN", ""),
         help="Telegram HTTP API token ($DELTATG_API_TOKEN)",
     )
+    parser.add_argument(
+        "--api-url",
+        type=str,
+        default=os.environ.get("DELTATG_API_URL", TG_API_URL),
+        help="Telegram HTTP API URL template ($DELTATG_API_URL)",
+    )
     parser.add_argument("--max-workers", type=int, default=None, help="processes limit")
+    parser.add_argument(
+        "--inline-timeout",
+        type=float,
+        default=DeltaTG.INLINE_REPLY_TIMEOUT,
+        help="seconds to wait for an answer to send it as webhook reply (0 -- always reply later)",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=DeltaTG.MAX_IN_FLIGHT,
+        help="messages being answered at once (the rest overflow)",
+    )
+    parser.add_argument(
+        "--overflow",
+        choices=DeltaTG.OVERFLOW_POLICIES,
+        default=DeltaTG.OVERFLOW_POLICY,
+        help="overflow policy: reject with 429, drop or send a quick reply",
+    )
+    parser.add_argument(
+        "--stats-url", type=str, default="/stats", help="queue stats path (GET, empty -- disabled)"
+    )
+    parser.add_argument(
+        "--metrics-url",
+        type=str,
+        default="/metrics",
+        help="Prometheus metrics path (GET, empty -- disabled)",
+    )
+    parser.add_argument(
+        "--reload-url",
+        type=str,
+        default=os.environ.get("DELTATG_RELOAD_URL", ""),
+        help="admin path to reload dictionaries (POST, empty -- disabled) ($DELTATG_RELOAD_URL)",
+    )
+    parser.add_argument(
+        "--watch",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help="reload dictionaries when files are changed (check interval, 0 -- disabled)",
+    )
     parser.add_argument(
         "--webhook-url",
         type=str,
@@ -182,18 +767,71 @@ def main():
         help="webhook path ($DELTATG_WEBHOOK_URL)",
     )
     parser.add_argument("--workers-sleep-time", type=float, default=0.0)
+    parser.add_argument(
+        "--cache", action="store_true", default=False, help="use precompiled dictionary cache files"
+    )
+    parser.add_argument(
+        "--load-workers",
+        type=int,
+        default=0,
+        metavar="N",
+        help="processes loading dictionaries (0 -- CPU count)",
+    )
+    parser.add_argument(
+        "--lookup-cache", type=int, default=0, metavar="SIZE", help="LRU lookup cache size (0 -- disabled)"
+    )
+    parser.add_argument(
+        "--lazy-compile", action="store_true", default=False, help="compile patterns on the first use"
+    )
+    parser.add_argument(
+        "--warm-up", action="store_true", default=False, help="compile patterns in background (lazy mode)"
+    )
+    parser.add_argument(
+        "--input-maxsize",
+        type=int,
+        default=TG_INPUT_MAXSIZE,
+        metavar="CHARS",
+        help="message is truncated before matching (0 -- no limit)",
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help="time limit for one message, empty answer if exceeded (0 -- unlimited)",
+    )
+    parser.add_argument(
+        "--step-budget",
+        type=int,
+        default=0,
+        metavar="N",
+        help="regexps evaluated and macros expanded for one message (0 -- unlimited)",
+    )
     parser.add_argument("--port", "-P", type=int, default=8000)
     parser.add_argument("--host", "-H", type=str, default="127.0.0.1")
     parser.add_argument("dictionary", nargs="+", help="load XML dictionary")
     args = parser.parse_args()
 
-    # set up debugging
-    delta.logger = setup_logger(args.debug)
-    if args.debug or args.verbose:
-        delta.DEBUG = True
-
-    delta.SHELL_ALLOWED = False
-    DeltaTG.WORKER_SLEEP_TIME = args.workers_sleep_time
+    # set up debugging and engine
+    settings = {
+        "debug": args.debug,
+        "verbose": args.verbose,
+        "cache": args.cache,
+        "load_workers": args.load_workers,
+        "lazy_compile": args.lazy_compile,
+        "lookup_cache": args.lookup_cache,
+        "workers_sleep_time": args.workers_sleep_time,
+        "warm_up": args.warm_up,
+        "input_maxsize": args.input_maxsize,
+        "time_budget": args.time_budget,
+        "step_budget": args.step_budget,
+        "watch": args.watch,
+    }
+    configure(settings)
+
+    DeltaTG.INLINE_REPLY_TIMEOUT = args.inline_timeout
+    DeltaTG.MAX_IN_FLIGHT = args.max_in_flight
+    DeltaTG.OVERFLOW_POLICY = args.overflow
 
     logging.info(
         "starting -- at %s:%s%s, with %s dicts, %s workers, using `%s…` token",
@@ -205,15 +843,34 @@ def main():
         args.api_token[:8],
     )
 
-    # create pool of workers
-    executor = concurrent.futures.ProcessPoolExecutor(max_workers=args.max_workers)
+    # load dictionaries once in the parent, forked workers share them
+    started = time.perf_counter()
+    DeltaTG.init_delta(args.dictionary)
+    if args.warm_up:
+        DeltaTG.engine.warm_up()
+    load_seconds = time.perf_counter() - started
+    logging.info("engine loaded in %.3fs, rss %s kB", load_seconds, memory_usage()[0])
 
-    # create a request handler (webhook)
-    handler = DeltaTG(args.dictionary, args.api_token, executor)
+    # create a request handler (webhook) and pool of workers
+    workers = args.max_workers or os.cpu_count() or 1
+    handler = DeltaTG(args.api_token, args.dictionary, settings, workers, args.api_url)
+    handler.load_seconds = load_seconds
+    handler.executor = handler.start_pool()
 
     # let the aiohttp magic begin!
     app = web.Application()
     app.add_routes([web.post(args.webhook_url, handler.webhook)])
+    if args.stats_url:
+        app.add_routes([web.get(args.stats_url, handler.stats_handler)])
+    if args.metrics_url:
+        app.add_routes([web.get(args.metrics_url, handler.metrics_handler)])
+    if args.reload_url:
+        app.add_routes([web.post(args.reload_url, handler.reload_handler)])
+    app.on_startup.append(handler.sender.start)
+    app.on_startup.append(handler.start_reload_triggers)
+    app.on_cleanup.append(handler.sender.close)
+    app.on_cleanup.append(handler.stop_reload_triggers)
+    app.on_cleanup.append(handler.log_stats)
     web.run_app(app, host=args.host, port=args.port, print=None)
 
 
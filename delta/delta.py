@@ -14,10 +14,28 @@ Usage example:
 
 """
 
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import heapq
+import os
+import pickle
 import random
 import re
 import subprocess
-import xml.sax
+import sys
+import tempfile
+import threading
+import time
+import xml.parsers.expat
+
+try:  # python 3.11+
+    from re import _parser as re_parser
+    from re._casefix import _EXTRA_CASES as RE_EXTRA_CASES
+except ImportError:  # pragma: no cover
+    import sre_parse as re_parser  # pylint: disable=deprecated-module
+    from sre_compile import _ignorecase_fixes as RE_EXTRA_CASES  # pylint: disable=deprecated-module
 
 __all__ = ["DEBUG", "SHELL_ALLOWED", "Delta", "logger"]
 
@@ -25,17 +43,38 @@ SHELL_ALLOWED = False
 DEBUG = False
 logger = None  # pylint: disable=invalid-name
 
+CACHE_VERSION = 4  # dictionary cache file format
+CACHE_SUFFIX = ".cache"
+
 SPACES_RE = re.compile(r"[ \t\n\r]+")
 MACROS_RE = re.compile(r"\$([a-zA-Z0-9_]+)\$")
 
+# case folding table: characters which `re` treats as equal in IGNORECASE mode
+# besides simple lower/upper pairs (e.g. `с` ~ `ᲃ`) are mapped to one of them
+FOLD_TABLE = str.maketrans({chr(k): chr(min(k, *v)) for k, v in RE_EXTRA_CASES.items()})
+
 
 class DictionaryEntry:
     """
     Dictionary entry:
     Every entry contains a list of patterns and list of answers.
     All patterns must be compiled before usage to make searching faster.
+    Lists are replaced with (shared) tuples after loading (see `compact`).
     """
 
+    __slots__ = (
+        "patterns",
+        "patterns_cmp",
+        "answers",
+        "exclusions",
+        "exclusions_cmp",
+        "priority",
+        "macros",
+        "compiled",
+        "literals",
+        "errors",
+    )
+
     re_flags = re.UNICODE | re.IGNORECASE  # regexp compiler flags
 
     def __init__(self, patterns=None, answers=None, exclusions=None, priority=0):
@@ -61,11 +100,53 @@ class DictionaryEntry:
         # entry priority
         self.priority = priority
 
+        # names of macros defined by patterns (`$name$`)
+        self.macros = []
+
+        # all regexps are compiled (may be postponed until the first match)
+        self.compiled = False
+
+        # required literals for every pattern and regexps errors (see `analyze_patterns`)
+        self.literals = None
+        self.errors = None
+
     def compile_patterns(self):
         """call compiler for all regexps (patterns and exclusions)"""
-        self.patterns_cmp = [self.re_compiler(x) for x in self.patterns]
-        if self.exclusions:
-            self.exclusions_cmp = [self.re_compiler(x) for x in self.exclusions]
+        patterns_cmp = tuple(self.re_compiler(x) for x in self.patterns)
+        exclusions_cmp = tuple(self.re_compiler(x) for x in self.exclusions)
+        self.patterns_cmp, self.exclusions_cmp = patterns_cmp, exclusions_cmp
+        self.compiled = True
+
+    def analyze_patterns(self):
+        """
+        Parse all regexps (without compiling) to find errors
+        and literal strings required by every pattern (used by dictionary index).
+        For every pattern the literals list contains:
+        - None -- pattern is broken and never matches,
+        - empty tuple -- nothing is known and pattern must be always tested,
+        - tuple of folded strings -- any matching input contains all of them.
+        """
+        literals = []
+        errors = []
+        for pattern in self.patterns:
+            parsed, error = _parse_pattern(pattern, self.re_flags)
+            literals.append(_pattern_literals(parsed) if error is None else None)
+            if error is not None:
+                errors.append((pattern, error))
+        for pattern in self.exclusions:
+            _, error = _parse_pattern(pattern, self.re_flags)
+            if error is not None:
+                errors.append((pattern, error))
+        self.literals = tuple(literals)
+        self.errors = tuple(errors)
+
+    def check_patterns(self):
+        """report regexps errors without compiling, returns True if there are no errors"""
+        if self.errors is None:
+            self.analyze_patterns()
+        for pattern, error in self.errors:
+            _log("error", "failed to compile pattern `%s`: %s", pattern, error)
+        return not self.errors
 
     def re_compiler(self, pattern):
         """compile pattern and log errors"""
@@ -74,6 +155,34 @@ class DictionaryEntry:
         except Exception as exc:  # pylint: disable=broad-except
             _log("error", "failed to compile pattern `%s`: %s", pattern, exc)
 
+    def compact(self, shared):
+        """
+        Replace lists with tuples and share equal strings, answers
+        and tuples with other entries (see `Dictionary.compact`).
+        Args:
+            shared (dict): objects already used by other entries
+        """
+        self.patterns = _shared(shared, tuple(_shared(shared, x) for x in self.patterns))
+        self.exclusions = _shared(shared, tuple(_shared(shared, x) for x in self.exclusions))
+        self.macros = _shared(shared, tuple(_shared(shared, x) for x in self.macros))
+        self.answers = _shared(shared, tuple(x.shared(shared) for x in self.answers))
+        if self.literals is not None:
+            self.literals = tuple(
+                x and _shared(shared, tuple(_shared(shared, y) for y in x)) for x in self.literals
+            )
+
+    def __getstate__(self):
+        """pickle entry without compiled regexps (see `Delta.load_dictionary`)"""
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state["patterns_cmp"] = ()
+        state["exclusions_cmp"] = ()
+        state["compiled"] = False
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __str__(self):
         return (
             f"`{self.patterns and self.patterns[0]}`=>`{self.answers and self.answers[0]}`"
@@ -93,6 +202,9 @@ class DictionaryEntry:
 
         emo = None  # entry matching object
 
+        if not self.compiled:  # lazy compilation
+            self.compile_patterns()
+
         # searching for good patterns
         for i, patt in enumerate(self.patterns_cmp):
 
@@ -102,7 +214,8 @@ class DictionaryEntry:
             emo = patt.search(inline)
 
             if emo is not None:
-                _log("debug", "matched: `%s` => `%s`", inline, self.patterns[i])
+                if DEBUG:
+                    _log("debug", "matched: `%s` => `%s`", inline, self.patterns[i])
                 break
 
         # nothing matched
@@ -110,22 +223,29 @@ class DictionaryEntry:
             return None
 
         # checking for exclusions
-        if self.exclusions:
-            for i, patt in enumerate(self.exclusions_cmp):
-                xmo = patt.search(inline)
-                if xmo is not None:
-                    _log("debug", "excluded: `%s` => `%s`", inline, self.exclusions[i])
-                    return None
+        if self.exclusions and self.excluded(inline):
+            return None
 
         return emo
 
+    def excluded(self, inline):
+        """test input against exclusion patterns"""
+        for i, patt in enumerate(self.exclusions_cmp):
+            if patt and patt.search(inline) is not None:
+                if DEBUG:
+                    _log("debug", "excluded: `%s` => `%s`", inline, self.exclusions[i])
+                return True
+        return False
+
+    def choose_answer(self, index=None, rng=None):
+        """gets random answer, returns Answer object"""
+        if index is not None and index < len(self.answers):
+            return self.answers[index]
+        return (rng or random).choice(self.answers)
+
     def get_answer(self, safe=True, index=None):
         """gets random answer, returns text"""
-        if index is not None and index < len(self.answers):
-            answer = self.answers[index]
-        else:
-            answer = random.choice(self.answers)
-        return answer.as_text(safe=safe)
+        return self.choose_answer(index).as_text(safe=safe)
 
 
 class Answer:
@@ -139,14 +259,19 @@ class Answer:
     ACTION_TYPES = {"text": TEXT, "eval": EVAL, "shell": SHELL}
     ACTION_TYPE_DEFAULT = TEXT
 
-    text = ""
-    action_type = ACTION_TYPE_DEFAULT
+    CHUNK, GROUP, MACRO = 1, 2, 3  # template items: text, `$1$`, `$name$`
+
+    __slots__ = ("text", "action_type", "template")
 
     def __init__(self, text=None, action_type=None):
-        if text:
-            self.text = text
-        if action_type:
-            self.action_type = self.ACTION_TYPES.get(action_type, self.ACTION_TYPE_DEFAULT)
+        self.text = text or ""
+        self.action_type = self.ACTION_TYPES.get(action_type, self.ACTION_TYPE_DEFAULT)
+        # answer text parsed into (item type, value) tuples (see `Delta.process_answer`)
+        self.template = _answer_template(self.text)
+
+    def shared(self, shared):
+        """returns the equal answer used by other entries (or this one)"""
+        return _shared(shared, self, key=(Answer, self.text, self.action_type))
 
     def run_shell(self):
         """runs a program (this feature is disabled by default)"""
@@ -188,33 +313,517 @@ class Answer:
         return self.text
 
 
+class DictionaryIndex:
+    """
+    Literal prefilter for dictionary lookup:
+    every pattern is keyed by a short substring (gram) of its required literal,
+    so only entries with some gram found in the input need to be tested.
+    Entries with patterns without any usable literal are always tested.
+    """
+
+    GRAM_SIZE = 3
+
+    def __init__(self, entries):
+        """
+        Args:
+            entries (list): dictionary entries (in lookup order).
+        """
+
+        self.always = set()  # entries to be tested for any input
+        self.grams = {}  # gram => set of entries positions
+        self.sizes = set()  # sizes of all grams in the index
+
+        # (entry position, literals) for every pattern with a required literal
+        keyed = []
+        for pos, entry in enumerate(entries):
+            if entry.literals is None:
+                entry.analyze_patterns()
+            for literals in entry.literals:
+                if literals is None:  # broken pattern
+                    continue
+                if not literals:
+                    self.always.add(pos)
+                else:
+                    keyed.append((pos, literals))
+
+        # count grams usage and pick the rarest gram for every pattern
+        usage = {}
+        for _, literals in keyed:
+            for gram in self.split(literals):
+                usage[gram] = usage.get(gram, 0) + 1
+
+        for pos, literals in keyed:
+            if pos in self.always:
+                continue
+            gram = min(self.split(literals), key=lambda x: (usage[x], -len(x)))
+            self.grams.setdefault(gram, set()).add(pos)
+            self.sizes.add(len(gram))
+
+        self.sizes = tuple(sorted(self.sizes))
+
+    def split(self, literals):
+        """all grams of required literals"""
+        grams = set()
+        for literal in literals:
+            size = min(self.GRAM_SIZE, len(literal))
+            grams.update(literal[i : i + size] for i in range(len(literal) - size + 1))
+        return grams
+
+    def candidates(self, inline):
+        """return sorted positions of entries which may match the input"""
+
+        folded = _fold(inline)
+        grams = self.grams
+        found = set(self.always)
+
+        for size in self.sizes:
+            for i in range(len(folded) - size + 1):
+                positions = grams.get(folded[i : i + size])
+                if positions is not None:
+                    found.update(positions)
+
+        return sorted(found)
+
+    @classmethod
+    def merge(cls, indexes, positions):
+        """
+        Merge indexes of dictionary layers (patterns are not analyzed again).
+        Args:
+            indexes (list): layers indexes.
+            positions (list): for every layer -- positions of its entries in the merged list.
+        """
+
+        merged = cls([])
+        sizes = set()
+
+        for index, mapping in zip(indexes, positions, strict=True):
+            merged.always.update(mapping[x] for x in index.always)
+            for gram, found in index.grams.items():
+                merged.grams.setdefault(gram, set()).update(mapping[x] for x in found)
+            sizes.update(index.sizes)
+
+        merged.sizes = tuple(sorted(sizes))
+        return merged
+
+
+class CombinedMatcher:
+    """
+    Compiled matcher for dictionary lookup:
+    patterns of consecutive entries are merged into large alternations,
+    so one scan tells if any entry of the chunk may match the input.
+    The whole dictionary alternation rejects non-matching inputs in one scan,
+    chunk alternations narrow the search down to a few entries,
+    which are tested one by one in priority order (with exclusions).
+    Patterns which cannot be merged (backreferences, named groups, global flags)
+    are tested one by one in place.
+    """
+
+    CHUNK_SIZE = 16  # max entries in one chunk alternation
+
+    GLOBAL_FLAGS_RE = re.compile(r"^\(\?[aiLmsux]+\)")
+
+    def __init__(self, entries):
+        """
+        Args:
+            entries (list): dictionary entries (in lookup order).
+        """
+
+        self.segments = []  # (regex or None, entries positions)
+        self.singles = []  # positions of entries which cannot be merged
+        self.gate = None  # alternation of all mergeable patterns
+
+        chunk = []
+        for pos, entry in enumerate(entries):
+            if not self.mergeable(entry):
+                self.add_segment(entries, chunk)
+                self.segments.append((None, [pos]))
+                self.singles.append(pos)
+                chunk = []
+                continue
+            chunk.append(pos)
+            if len(chunk) >= self.CHUNK_SIZE:
+                self.add_segment(entries, chunk)
+                chunk = []
+        self.add_segment(entries, chunk)
+
+        merged = [pos for regex, chunk in self.segments if regex is not None for pos in chunk]
+        self.gate = self.compile(entries, merged)
+
+    def mergeable(self, entry):
+        """check that all entry patterns may be merged into alternation"""
+
+        if entry.re_flags != DictionaryEntry.re_flags:
+            return False
+
+        if entry.literals is None:
+            entry.analyze_patterns()
+
+        for pattern, literals in zip(entry.patterns, entry.literals, strict=True):
+            if literals is None:  # broken pattern, never matches
+                continue
+            if self.GLOBAL_FLAGS_RE.match(pattern):
+                return False
+            parsed = re_parser.parse(pattern, int(entry.re_flags))
+            if parsed.state.groupdict or _has_groupref(parsed):
+                return False
+
+        return True
+
+    def compile(self, entries, positions):
+        """compile alternation of all entries patterns"""
+
+        alternatives = [
+            f"(?:{pattern})"
+            for pos in positions
+            for pattern, literals in zip(entries[pos].patterns, entries[pos].literals, strict=True)
+            if literals is not None
+        ]
+
+        if not alternatives:
+            return None
+
+        try:
+            return re.compile("|".join(alternatives), DictionaryEntry.re_flags)
+        except Exception as exc:  # pylint: disable=broad-except
+            _log("warning", "failed to merge patterns (%s entries): %s", len(positions), exc)
+            return None
+
+    def add_segment(self, entries, chunk):
+        """add chunk of mergeable entries"""
+
+        if not chunk:
+            return
+
+        regex = self.compile(entries, chunk)
+        if regex is None:  # never matches or cannot be merged
+            self.segments.extend((None, [pos]) for pos in chunk)
+            self.singles.extend(chunk)
+            return
+
+        self.segments.append((regex, chunk))
+
+    def candidates(self, inline):
+        """positions of entries which may match the input (in order, generated lazily)"""
+
+        segments = self.segments
+        if self.gate is not None and self.gate.search(inline) is None:
+            segments = [(None, self.singles)]
+
+        for regex, positions in segments:
+            if regex is not None and regex.search(inline) is None:
+                continue
+            yield from positions
+
+    def lookup(self, entries, inline):
+        """find first matching entry, returns (entry, emo) or (None, None)"""
+
+        for pos in self.candidates(inline):
+            emo = entries[pos].match(inline)
+            if emo is not None:
+                return (entries[pos], emo)
+
+        return (None, None)
+
+
+class DictionaryLayer:
+    """
+    Dictionary layer is a list of entries added together (e.g. loaded from one file)
+    with its own lookup structures. Sorted layer entries are ordered by priority
+    (the earlier entry wins on the same priority).
+    """
+
+    def __init__(self, name=None, entries=None):
+        """
+        Args:
+            name (str, optional): layer name (dictionary file name).
+            entries (list, optional): dictionary entries.
+        """
+        self.name = name
+        self.entries = list(entries or [])
+        self.sorted = False  # entries are ordered by priority
+        self.index = None  # literal prefilter index (built on demand)
+        self.matcher = None  # combined alternation matcher (built on demand)
+
+    def append(self, entry):
+        """add new entry (to the end, until the layer is sorted again)"""
+        self.entries.append(entry)
+        self.sorted = False
+        self.index = None
+        self.matcher = None
+
+    def sort(self):
+        """sort entries list by priority"""
+        self.entries.sort(key=lambda x: -x.priority)
+        self.sorted = True
+        self.index = None
+        self.matcher = None
+
+    def build_index(self, combined=False):
+        """(re)build literal prefilter index (or combined matcher)"""
+
+        if combined:
+            self.matcher = CombinedMatcher(self.entries)
+            _log("debug", "matcher built (%s): %s segments", self.name, len(self.matcher.segments))
+        else:
+            self.index = DictionaryIndex(self.entries)
+            _log(
+                "debug",
+                "index built (%s): %s grams, %s entries always tested",
+                self.name,
+                len(self.index.grams),
+                len(self.index.always),
+            )
+
+    def candidates(self, inline, use_index=True, use_combined=False):
+        """positions of entries which may match the input (in order)"""
+
+        if use_combined:
+            if self.matcher is None:
+                self.build_index(combined=True)
+            return self.matcher.candidates(inline)
+
+        if not use_index:
+            return range(len(self.entries))
+
+        if self.index is None:
+            self.build_index()
+
+        return self.index.candidates(inline)
+
+    def lookup_keys(self, num, positions=None):
+        """
+        lookup order keys (priority, layer number, position) of entries
+        at given positions (default: all), see `Dictionary.lookup`
+        """
+        entries = self.entries
+        if positions is None:
+            positions = range(len(entries))
+        keys = ((-entries[pos].priority, num, pos) for pos in positions)
+        return keys if self.sorted else sorted(keys)
+
+    def lookup(self, inline, use_index=True, use_combined=False):
+        """
+        Find first matching entry of the layer.
+        Returns:
+            A tuple of entry and entry match object, or (None, None).
+        """
+
+        entries = self.entries
+        for pos in self.candidates(inline, use_index, use_combined):
+            emo = entries[pos].match(inline)
+            if emo is not None:
+                return (entries[pos], emo)
+
+        return (None, None)
+
+
 class Dictionary:
     """
     Dictionary is a collection of dictionary entries
+    organized in layers (one layer for every loaded file).
+    Lookup result is the same as for one list of all entries sorted by priority:
+    on the same priority the entry from the earlier layer wins.
+    Layers are sorted and indexed separately, so adding or removing a layer
+    does not touch the others: the merged list and index are built in linear time.
     """
 
+    use_index = True  # use literal prefilter index in lookup
+    use_combined = False  # use combined alternation matcher in lookup
+    lazy_compile = False  # compile entry regexps on the first match
+    strict = True  # report regexps errors at load time (in lazy mode too)
+
     def __init__(self):
-        self.entries = []  # dictionary entries
+        self.layers = []  # dictionary layers (in load order)
+        self.merged = None  # merged entries of all layers (built on demand, see `merge`)
+        self.index = None  # merged literal prefilter index of all layers (built on demand)
+        self.macros = {}  # `$name$` => lookup result (macro table)
+        self.version = 0  # incremented on every change (see `LookupCache`)
+
+    @property
+    def entries(self):
+        """all dictionary entries (in lookup order)"""
+        if len(self.layers) == 1:
+            return self.layers[0].entries
+        return self.merge()[0]
+
+    def changed(self):
+        """drop everything built for the old entries"""
+        self.merged = None
+        self.index = None
+        self.macros = {}
+        self.version += 1
+
+    def merge(self):
+        """
+        Merge entries of all layers in lookup order (priority, layer, position).
+        Returns:
+            A tuple of merged entries list and positions of every layer entries in it.
+        """
+
+        merged = self.merged
+        if merged is None:
+            layers = self.layers
+            entries = []
+            positions = [[0] * len(x.entries) for x in layers]
+            for _, num, pos in heapq.merge(*(x.lookup_keys(num) for num, x in enumerate(layers))):
+                positions[num][pos] = len(entries)
+                entries.append(layers[num].entries[pos])
+            merged = self.merged = (entries, positions)
+
+        return merged
+
+    def build_merged_index(self):
+        """merge literal prefilter indexes of all layers"""
+        for layer in self.layers:
+            if layer.index is None:
+                layer.build_index()
+        self.index = DictionaryIndex.merge([x.index for x in self.layers], self.merge()[1])
+
+    def prepare(self, entry):
+        """compile entry regexps (or check them in lazy mode)"""
+        if not self.lazy_compile:
+            entry.compile_patterns()
+        elif self.strict:
+            entry.check_patterns()
 
     def append(self, entry, and_compile=True):
-        """add new dictionary entry"""
+        """add new dictionary entry (to the last layer, unless it is a loaded file)"""
         if and_compile:
-            entry.compile_patterns()
-        self.entries.append(entry)
+            self.prepare(entry)
+        if not self.layers or self.layers[-1].name is not None:
+            self.layers.append(DictionaryLayer())
+        self.layers[-1].append(entry)
+        self.changed()
         _log("debug", "added entry %s", entry)
 
+    def add_layer(self, entries, name=None, and_compile=True):
+        """
+        Add new layer (sorted, other layers are not touched).
+        Args:
+            entries (list): dictionary entries.
+            name (str, optional): layer name (see `remove_layer`).
+        Returns:
+            The new layer.
+        """
+        if and_compile:
+            for entry in entries:
+                self.prepare(entry)
+        layer = DictionaryLayer(name, entries)
+        layer.sort()
+        self.layers.append(layer)
+        self.changed()
+        _log("debug", "added layer %s (%s)", name, len(layer.entries))
+        return layer
+
+    def remove_layer(self, name):
+        """remove layers with the given name, returns number of removed entries"""
+        removed = [x for x in self.layers if x.name == name]
+        if removed:
+            self.layers = [x for x in self.layers if x.name != name]
+            self.changed()
+        return sum(len(x.entries) for x in removed)
+
     def sort(self):
-        """sort entries list by priority"""
-        self.entries.sort(key=lambda x: -x.priority)
+        """sort entries by priority (only layers with new entries are sorted)"""
+        for layer in self.layers:
+            if not layer.sorted:
+                layer.sort()
+        self.changed()
+
+    def compact(self, entries=None):
+        """make entries compact (default: all), equal objects are shared between them"""
+        shared = {}  # not kept: entries compacted before are shared again on the next call
+        for entry in self.entries if entries is None else entries:
+            entry.compact(shared)
+
+    def memory_report(self):
+        """approximate memory used by entries (shared objects are counted once)"""
+        seen = set()
+        entries = self.entries
+        size = sum(_sizeof(entry, seen) for entry in entries)
+        return {
+            "entries": len(entries),
+            "layers": len(self.layers),
+            "bytes": size,
+            "bytes_per_entry": size // (len(entries) or 1),
+        }
+
+    def build_index(self):
+        """build missing literal prefilter indexes (or combined matchers) and macro table"""
+
+        for layer in self.layers:
+            if (layer.matcher if self.use_combined else layer.index) is None:
+                layer.build_index(self.use_combined)
+
+        if len(self.layers) > 1 and not self.use_combined:
+            self.build_merged_index()
+
+        # lookup results for all defined macros are known in advance
+        # (in lazy mode the table is filled on the first use)
+        self.macros = {}
+        if not self.lazy_compile:
+            for layer in self.layers:
+                for entry in layer.entries:
+                    for name in entry.macros:
+                        self.lookup_macro(name)
+
+    def lookup_macro(self, name):
+        """
+        Look up for macro expansion entry (the same as `lookup("$name$")`).
+        All results are saved into the macro table, so the full lookup is done
+        only once for every macro name.
+        Args:
+            name (str): macro name
+        Returns:
+            A tuple of entry and entry match object,
+            or (None, None) -- if nothing found.
+        """
+
+        inline = f"${name}$".lower()
+
+        found = self.macros.get(inline)
+        if found is None:
+            found = self.macros[inline] = self.lookup(inline)
+
+        return found
 
     def print(self):
         """print dictionary contents"""
-        print(len(self.entries), " items in the dictionary")
-        print("\n".join(map(str, self.entries)))
+        entries = self.entries
+        print(len(entries), " items in the dictionary")
+        print("\n".join(map(str, entries)))
 
     def __len__(self):
         """return length of the dictionary"""
-        return len(self.entries) if self.entries else 0
+        return sum(len(x.entries) for x in self.layers)
+
+    def candidates(self, inline):
+        """
+        Entries which may match the input in lookup order (generated lazily),
+        the same as tested by `lookup` (which does not use it to keep the hot path short).
+        """
+
+        layers = self.layers
+        if len(layers) == 1:
+            entries = layers[0].entries
+            return (entries[pos] for pos in layers[0].candidates(inline, self.use_index, self.use_combined))
+
+        if self.use_combined:
+            streams = [
+                layer.lookup_keys(num, layer.candidates(inline, use_combined=True))
+                for num, layer in enumerate(layers)
+            ]
+            return (layers[num].entries[pos] for _, num, pos in heapq.merge(*streams))
+
+        entries = self.merge()[0]
+
+        if not self.use_index:
+            return iter(entries)
+
+        if self.index is None:
+            self.build_merged_index()
+
+        return (entries[pos] for pos in self.index.candidates(inline))
 
     def lookup(self, inline):
         """
@@ -226,14 +835,341 @@ class Dictionary:
             or (None, None) -- if nothing found.
         """
 
-        for entry in self.entries:
-            emo = entry.match(inline)
+        layers = self.layers
+        if len(layers) == 1:
+            return layers[0].lookup(inline, self.use_index, self.use_combined)
+
+        if self.use_combined:
+            # candidates of all layers are tested in lookup order: priority, layer, position
+            streams = [
+                layer.lookup_keys(num, layer.candidates(inline, use_combined=True))
+                for num, layer in enumerate(layers)
+            ]
+            for _, num, pos in heapq.merge(*streams):
+                emo = layers[num].entries[pos].match(inline)
+                if emo is not None:
+                    return (layers[num].entries[pos], emo)
+            return (None, None)
+
+        entries = self.merge()[0]
+
+        if not self.use_index:
+            candidates = range(len(entries))
+        else:
+            if self.index is None:
+                self.build_merged_index()
+            candidates = self.index.candidates(inline)
+
+        for pos in candidates:
+            emo = entries[pos].match(inline)
+            if emo is not None:
+                return (entries[pos], emo)
+
+        return (None, None)
+
+
+class Profiler:
+    """
+    Opt-in lookup profiler (see `Delta.PROFILE`): for every entry and every pattern
+    counts evaluations, matches and regexps time, and macro expansions time.
+    Lookups are done by a separate (slower) code path, so profiling costs nothing when disabled.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}  # entry => [evals, matches, seconds, patterns stats, exclusions stats]
+        self.macros = {}  # macro name => [expansions, seconds]
+        self.lookups = 0
+        self.seconds = 0.0  # total lookups time
+
+    def lookup(self, dictionary, inline):
+        """
+        Look up for the input (the same result as `Dictionary.lookup`) and record regexps stats.
+        Returns:
+            A tuple of entry and entry match object, or (None, None).
+        """
+
+        clock = time.perf_counter
+        started = clock()
+        found = (None, None)
+        tested = []
+
+        for entry in dictionary.candidates(inline):
+            if not entry.compiled:
+                entry.compile_patterns()
+
+            # (index, seconds, matched) of evaluated patterns and exclusions
+            patterns = []
+            exclusions = []
+            emo = None
+
+            for i, patt in enumerate(entry.patterns_cmp):
+                if patt:
+                    begin = clock()
+                    emo = patt.search(inline)
+                    patterns.append((i, clock() - begin, emo is not None))
+                    if emo is not None:
+                        break
+
+            if emo is not None:
+                for i, patt in enumerate(entry.exclusions_cmp):
+                    if patt:
+                        begin = clock()
+                        excluded = patt.search(inline) is not None
+                        exclusions.append((i, clock() - begin, excluded))
+                        if excluded:
+                            emo = None
+                            break
+
+            tested.append((entry, patterns, exclusions, emo))
+            if emo is not None:
+                found = (entry, emo)
+                break
+
+        elapsed = clock() - started
+
+        with self.lock:
+            self.lookups += 1
+            self.seconds += elapsed
+            for entry, patterns, exclusions, emo in tested:
+                stats = self.entries.get(entry)
+                if stats is None:
+                    stats = self.entries[entry] = [
+                        0,
+                        0,
+                        0.0,
+                        [[0, 0, 0.0] for _ in entry.patterns],
+                        [[0, 0, 0.0] for _ in entry.exclusions],
+                    ]
+                stats[0] += 1
+                stats[1] += emo is not None
+                for evaluated, patterns_stats in ((patterns, stats[3]), (exclusions, stats[4])):
+                    for i, seconds, matched in evaluated:
+                        patterns_stats[i][0] += 1
+                        patterns_stats[i][1] += matched
+                        patterns_stats[i][2] += seconds
+                        stats[2] += seconds
+
+        return found
+
+    def add_macro(self, name, seconds):
+        """record macro expansion time (nested expansions included)"""
+        with self.lock:
+            stats = self.macros.setdefault(name, [0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+
+    def reset(self):
+        """forget all collected stats"""
+        with self.lock:
+            self.entries = {}
+            self.macros = {}
+            self.lookups = 0
+            self.seconds = 0.0
+
+    def report(self, dictionary=None):
+        """
+        Collected stats (JSON serializable), entries are sorted by regexps time
+        (exclusion `matches` are excluded inputs).
+        Args:
+            dictionary (Dictionary, optional): report never evaluated entries of the dictionary too.
+        """
+
+        def _patterns(patterns, stats):
+            return [
+                {"pattern": x, "evals": y[0], "matches": y[1], "seconds": y[2]}
+                for x, y in zip(patterns, stats, strict=True)
+            ]
+
+        with self.lock:
+            entries = [
+                {
+                    "entry": str(entry),
+                    "priority": entry.priority,
+                    "evals": stats[0],
+                    "matches": stats[1],
+                    "seconds": stats[2],
+                    "patterns": _patterns(entry.patterns, stats[3]),
+                    "exclusions": _patterns(entry.exclusions, stats[4]),
+                }
+                for entry, stats in self.entries.items()
+            ]
+            macros = {name: {"expansions": x[0], "seconds": x[1]} for name, x in self.macros.items()}
+            seen = set(self.entries)
+            matched = {entry for entry, stats in self.entries.items() if stats[1]}
+
+        entries.sort(key=lambda x: -x["seconds"])
+
+        result = {
+            "lookups": self.lookups,
+            "seconds": self.seconds,
+            "entries": entries,
+            "macros": dict(sorted(macros.items(), key=lambda x: -x[1]["seconds"])),
+        }
+
+        if dictionary is not None:
+            all_entries = dictionary.entries
+            result["never_evaluated"] = [str(x) for x in all_entries if x not in seen]
+            result["never_matched"] = [str(x) for x in all_entries if x not in matched]
+
+        return result
+
+    @staticmethod
+    def format_report(report, top=20):
+        """sorted text report (see `report`): the most expensive entries, patterns and macros"""
+
+        lines = [f"lookups: {report['lookups']}, {report['seconds']:.3f}s"]
+
+        lines.append(f"top {top} entries by regexps time:")
+        for entry in report["entries"][:top]:
+            lines.append(
+                f"  {entry['seconds']:.6f}s {entry['evals']:>8} evals {entry['matches']:>8} matches"
+                f"  pri={entry['priority']} {entry['entry']}"
+            )
+
+        patterns = [x for entry in report["entries"] for x in entry["patterns"] + entry["exclusions"]]
+        patterns.sort(key=lambda x: -x["seconds"])
+        lines.append(f"top {top} patterns by time per evaluation:")
+        for pattern in sorted(patterns[: top * 5], key=lambda x: -x["seconds"] / (x["evals"] or 1))[:top]:
+            lines.append(
+                f"  {pattern['seconds'] / (pattern['evals'] or 1) * 1e6:.1f}us {pattern['evals']:>8} evals"
+                f" {pattern['matches']:>8} matches  `{pattern['pattern']}`"
+            )
+
+        lines.append(f"top {top} macros by expansion time:")
+        for name, macro in list(report["macros"].items())[:top]:
+            lines.append(f"  {macro['seconds']:.6f}s {macro['expansions']:>8} expansions  ${name}$")
+
+        for key in ("never_evaluated", "never_matched"):
+            if key in report:
+                lines.append(f"{key.replace('_', ' ')}: {len(report[key])} entries")
+                lines.extend(f"  {x}" for x in report[key][:top])
+
+        return "\n".join(lines)
+
+
+class Budget:
+    """
+    Per-request time and steps (regexps evaluated, macros expanded) limits,
+    checked between steps (see `Delta.TIME_BUDGET`, `Delta.STEP_BUDGET`).
+    """
+
+    __slots__ = ("deadline", "steps")
+
+    def __init__(self, seconds=0, steps=0):
+        """
+        Args:
+            seconds (float, optional): time limit (0 -- unlimited).
+            steps (int, optional): steps limit (0 -- unlimited).
+        """
+        self.deadline = time.perf_counter() + seconds if seconds > 0 else None
+        self.steps = steps if steps > 0 else None  # steps left
+
+    def spend(self, steps=1):
+        """count step(s), raise `BudgetExceeded` if the budget is exhausted"""
+        if self.steps is not None:
+            self.steps -= steps
+            if self.steps < 0:
+                raise BudgetExceeded("steps")
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise BudgetExceeded("time")
+
+    def lookup(self, dictionary, inline):
+        """
+        Look up for the input (the same result as `Dictionary.lookup`), one step for every regexp
+        (spent after every entry).
+        Returns:
+            A tuple of entry and entry match object, or (None, None).
+        """
+
+        for entry in dictionary.candidates(inline):
+            if not entry.compiled:
+                entry.compile_patterns()
+
+            emo = None
+            steps = 0
+            for patt in entry.patterns_cmp:
+                if patt:
+                    steps += 1
+                    emo = patt.search(inline)
+                    if emo is not None:
+                        break
+
+            if emo is not None:
+                for patt in entry.exclusions_cmp:
+                    if patt:
+                        steps += 1
+                        if patt.search(inline) is not None:
+                            emo = None
+                            break
+
+            self.spend(steps)
             if emo is not None:
                 return (entry, emo)
 
         return (None, None)
 
 
+class BudgetExceeded(Exception):
+    """request budget is exhausted, `args[0]` is the cause: `time` or `steps` (see `Budget`)"""
+
+
+class LookupCache:
+    """
+    Bounded LRU cache of dictionary lookup results:
+    cleaned input => (matched entry, entry match object).
+    Final answers are not cached, so they are still chosen randomly.
+    Cache is cleared when the dictionary version changes.
+    """
+
+    def __init__(self, size):
+        """
+        Args:
+            size (int): max number of cached inputs.
+        """
+        self.size = size
+        self.items = collections.OrderedDict()
+        self.version = None  # dictionary version of cached results
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, inline, version):
+        """get cached lookup result or None"""
+        with self.lock:
+            if version != self.version:
+                self.items.clear()
+                self.version = version
+            found = self.items.get(inline)
+            if found is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(inline)
+            self.hits += 1
+            return found
+
+    def put(self, inline, found, version):
+        """save lookup result"""
+        with self.lock:
+            if version != self.version:
+                return
+            self.items[inline] = found
+            if len(self.items) > self.size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """cache statistics"""
+        return {
+            "size": len(self.items),
+            "max_size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
 class Delta:
     """
     Answering machine engine
@@ -244,41 +1180,187 @@ class Delta:
     MAX_PARSER_DEPTH = 25
     EMPTY_RESPONSE = ""
 
+    DICTIONARY_CACHE = False  # load (and save) precompiled dictionary cache files
+    LOAD_WORKERS = 0  # processes for `load_dictionaries` (0 -- CPU count, 1 -- no pool)
+    LOOKUP_CACHE_SIZE = 0  # LRU lookup cache size (0 -- no cache)
+    PROFILE = False  # collect per entry and per pattern stats (see `Profiler`, lookups are not budgeted)
+
+    INPUT_MAXSIZE = 0  # input is truncated to this number of characters before matching (0 -- no limit)
+    TIME_BUDGET = 0  # seconds for one request (0 -- unlimited, see `Budget`)
+    STEP_BUDGET = 0  # regexps evaluated and macros expanded for one request (0 -- unlimited)
+    BUDGET_RESPONSE = None  # answer when the budget is exhausted (None -- EMPTY_RESPONSE)
+
     def __init__(self):
         """Initializer has no arguments"""
         self.dictionary = Dictionary()
+        self.cache = LookupCache(self.LOOKUP_CACHE_SIZE) if self.LOOKUP_CACHE_SIZE > 0 else None
+        self.profiler = Profiler() if self.PROFILE else None
+        self.exceeded = {"time": 0, "steps": 0}  # requests aborted by budget (by cause)
 
-    def load_dictionary(self, filename):
+    def load_dictionary(self, filename, use_cache=None):
         """
         Load dictionary from XML file (new records appended to existing dictionary).
+        If cache is enabled, parsed and analyzed entries are loaded from the cache file
+        (`filename` + CACHE_SUFFIX) when it is fresh, otherwise the cache file is rebuilt.
+        Cache file is a pickle -- it must be as trusted as the dictionary itself.
         Args:
             filename (str): XML file
+            use_cache (bool, optional): use cache file (default: DICTIONARY_CACHE)
         Returns:
             Total number of dictionary entries.
         Raises:
             Exception if the file cannot be opened or parsed.
         """
 
-        with open(filename, "rb") as infile:
+        if use_cache is None:
+            use_cache = self.DICTIONARY_CACHE
 
-            # Set input file as a input stream for the parser
-            isource = xml.sax.xmlreader.InputSource()
-            isource.setByteStream(infile)
+        entries, errors = _read_dictionary(filename, use_cache)
+        for line, message in errors:
+            _log("warning", "%s:%s: %s", filename, line, message)
 
-            # Parser creation
-            xparser = xml.sax.make_parser()
+        # new layer, entries are reordered by priority flag
+        layer = self.dictionary.add_layer(entries, name=filename)
+        self.dictionary.compact(layer.entries)
+        self.dictionary.build_index()
 
-            xhandler = DeltaDictionaryXMLHandler(self.dictionary)
-            xparser.setContentHandler(xhandler)
+        _log("info", "loaded dictionary %s (%s)", filename, len(self.dictionary))
+        return len(self.dictionary)
 
-            xparser.parse(isource)
+    def load_dictionaries(self, filenames, use_cache=None, workers=None):
+        """
+        Load dictionaries from XML files, files are read and parsed in parallel by a process pool.
+        Layers are added in the given order, so the result is the same as for sequential
+        `load_dictionary` calls (regexps are compiled by this process).
+        Failed files are skipped (errors are logged).
+        Args:
+            filenames (list): XML files
+            use_cache (bool, optional): use cache files (default: DICTIONARY_CACHE)
+            workers (int, optional): number of processes (default: LOAD_WORKERS)
+        Returns:
+            A list of dicts for every file: filename, entries, warnings (broken entries),
+            error and time spent (seconds).
+        """
 
-        # Reorder dictionary entries by priority flag.
-        self.dictionary.sort()
+        if use_cache is None:
+            use_cache = self.DICTIONARY_CACHE
 
-        _log("info", "loaded dictionary %s (%s)", filename, len(self.dictionary))
+        if workers is None:
+            workers = self.LOAD_WORKERS
+        workers = min(workers or os.cpu_count() or 1, len(filenames))
+
+        tasks = [(filename, use_cache) for filename in filenames]
+        if workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_read_dictionary_task, tasks))
+        else:
+            results = [_read_dictionary_task(task) for task in tasks]
+
+        report = []
+        for filename, (entries, errors, error, seconds) in zip(filenames, results, strict=True):
+            for line, message in errors or ():
+                _log("warning", "%s:%s: %s", filename, line, message)
+            if error is None:
+                started = time.perf_counter()
+                layer = self.dictionary.add_layer(entries, name=filename)
+                self.dictionary.compact(layer.entries)
+                seconds += time.perf_counter() - started
+                _log("debug", "loaded dictionary %s (%s) in %.3fs", filename, len(entries), seconds)
+            else:
+                _log("error", "failed to load dictionary %s: %s", filename, error)
+            report.append({
+                "filename": filename,
+                "entries": len(entries) if error is None else 0,
+                "warnings": len(errors or ()),
+                "error": error,
+                "seconds": seconds,
+            })
+
+        self.dictionary.build_index()
+
+        return report
+
+    def unload_dictionary(self, filename):
+        """
+        Remove entries loaded from the file (other dictionaries are not touched).
+        Returns:
+            Total number of dictionary entries.
+        """
+
+        removed = self.dictionary.remove_layer(filename)
+        self.dictionary.build_index()  # macro table
+
+        _log("info", "unloaded dictionary %s (%s)", filename, removed)
+        return len(self.dictionary)
+
+    def load_new_dictionary(self, filenames, workers=None):
+        """
+        Load dictionaries into a new dictionary, the current one is not touched.
+        Args:
+            filenames (list): XML files
+            workers (int, optional): see `load_dictionaries`.
+        Returns:
+            Dictionary to be swapped in (see `reload_dictionaries`).
+        Raises:
+            RuntimeError if a file cannot be opened or parsed.
+        """
+
+        loader = type(self)()
+        for result in loader.load_dictionaries(filenames, workers=workers):
+            if result["error"] is not None:
+                raise RuntimeError(f"failed to load dictionary {result['filename']}: {result['error']}")
+
+        # newer than anything cached for the old dictionary
+        loader.dictionary.version += self.dictionary.version + 1
+
+        return loader.dictionary
+
+    def reload_dictionaries(self, filenames):
+        """
+        Load dictionaries into a new dictionary and swap it in atomically.
+        Parsing in progress is finished with the old dictionary,
+        the old dictionary is kept if any of the files fails to load.
+        Args:
+            filenames (list): XML files
+        Returns:
+            Total number of dictionary entries.
+        Raises:
+            RuntimeError if a file cannot be opened or parsed.
+        """
+
+        self.dictionary = self.load_new_dictionary(filenames)
+
+        _log("info", "reloaded dictionaries %s (%s)", filenames, len(self.dictionary))
         return len(self.dictionary)
 
+    def warm_up(self, background=False, dictionary=None):
+        """
+        Compile all not yet compiled dictionary regexps (see `Dictionary.lazy_compile`).
+        Args:
+            background (bool, optional): compile in a background thread.
+            dictionary (Dictionary, optional): dictionary to compile instead of the current one.
+        Returns:
+            The background thread or None.
+        """
+
+        if dictionary is None:
+            dictionary = self.dictionary
+
+        if background:
+            thread = threading.Thread(
+                target=self.warm_up, kwargs={"dictionary": dictionary}, name="delta-warm-up", daemon=True
+            )
+            thread.start()
+            return thread
+
+        entries = [x for x in dictionary.entries if not x.compiled]
+        for entry in entries:
+            if not entry.compiled:
+                entry.compile_patterns()
+
+        _log("info", "warmed up %s entries", len(entries))
+        return None
+
     def save_dictionary(self, filename):
         """
         Save dictionary into XML-file. FIXME: NIY!
@@ -296,25 +1378,159 @@ class Delta:
         Raises:
             An Exception in case of error (any type)
         """
+        return self.parse_entry(inline, depth)[0]
+
+    def parse_entry(self, inline, depth=0):
+        """
+        Parse input line and generate the answer (see `parse`).
+        If the request budget is exhausted, the answer is BUDGET_RESPONSE (see `Budget`).
+        Returns:
+            A tuple of answer string and matched dictionary entry (or None).
+        """
 
         if depth > self.MAX_PARSER_DEPTH:  # avoid infinite looping
             _log("warning", "I went too deep (%s)", depth)
-            return self.EMPTY_RESPONSE
+            return (self.EMPTY_RESPONSE, None)
 
         # clean input
-        inline = SPACES_RE.sub(" ", inline.lower().strip())
+        inline = self.clean_input(inline)
+
+        # the same dictionary for the whole parse (see `reload_dictionaries`)
+        dictionary = self.dictionary
+        budget = self.budget()
+
+        try:
+            # search for matching dictionary entry
+            entry, emo = self.lookup(inline, dictionary, budget)
+            if DEBUG:
+                _log("debug", "looked up for `%s` => %s", inline, entry)
+
+            # postprocess answer
+            answer = self.process_answer(emo, entry, depth, dictionary=dictionary, budget=budget)
+            if DEBUG:
+                _log("debug", "parsed answer: `%s`", answer)
+        except BudgetExceeded as exc:
+            return (self.budget_exceeded(exc, inline), None)
+
+        return (answer, entry)
+
+    def clean_input(self, inline):
+        """truncate input (see INPUT_MAXSIZE), lowercase it and squeeze spaces"""
+        if 0 < self.INPUT_MAXSIZE < len(inline):
+            inline = inline[: self.INPUT_MAXSIZE]
+        return SPACES_RE.sub(" ", inline.lower().strip())
+
+    def budget(self):
+        """new request budget, None if unlimited"""
+        if self.TIME_BUDGET > 0 or self.STEP_BUDGET > 0:
+            return Budget(self.TIME_BUDGET, self.STEP_BUDGET)
+        return None
+
+    def budget_exceeded(self, exc, inline):
+        """count aborted request, returns the answer for it"""
+        cause = exc.args[0]
+        self.exceeded[cause] = self.exceeded.get(cause, 0) + 1
+        _log("warning", "request budget exceeded (%s): `%.80s`", cause, inline)
+        return self.EMPTY_RESPONSE if self.BUDGET_RESPONSE is None else self.BUDGET_RESPONSE
+
+    def lookup(self, inline, dictionary=None, budget=None):
+        """
+        Look up for cleaned input in the dictionary (via lookup cache if enabled).
+        Raises:
+            BudgetExceeded if the budget is exhausted (aborted lookups are not cached).
+        Returns:
+            A tuple of entry and entry match object, or (None, None).
+        """
+
+        if dictionary is None:
+            dictionary = self.dictionary
+
+        lookup = dictionary.lookup
+        if self.profiler is not None:
+            lookup = functools.partial(self.profiler.lookup, dictionary)
+        elif budget is not None:
+            lookup = functools.partial(budget.lookup, dictionary)
+
+        cache = self.cache
+        if cache is None:
+            return lookup(inline)
+
+        version = dictionary.version
+        found = cache.get(inline, version)
+        if found is None:
+            found = lookup(inline)
+            cache.put(inline, found, version)
+
+        return found
 
-        # search for matching dictionary entry
-        (entry, emo) = self.dictionary.lookup(inline)
-        _log("debug", "looked up for `%s` => %s", inline, entry)
+    def parse_many(self, inlines, seed=None):
+        """
+        Parse many input lines at once (see `parse`).
+        Identical inputs (raw or cleaned) are cleaned and looked up only once,
+        answers are still chosen randomly for every input (with its own budget).
+        Args:
+            inlines (iterable): input strings.
+            seed (optional): random seed to make answers reproducible.
+        Returns:
+            A list of answers (in the input order).
+        """
+
+        rng = random.Random(seed) if seed is not None else None
+        dictionary = self.dictionary
+        lookup = self.lookup
+        process_answer = self.process_answer
+
+        found = {}  # raw and cleaned inputs => (entry, emo)
+        answers = []
+        lookups = 0
+
+        for inline in inlines:
+            budget = self.budget()
+            try:
+                result = found.get(inline)
+                if result is None:
+                    cleaned = self.clean_input(inline)
+                    result = found.get(cleaned)
+                    if result is None:
+                        result = found[cleaned] = lookup(cleaned, dictionary, budget)
+                        lookups += 1
+                    found[inline] = result
+                answers.append(process_answer(result[1], result[0], 0, rng, dictionary, budget))
+            except BudgetExceeded as exc:
+                answers.append(self.budget_exceeded(exc, inline))
+
+        if DEBUG:
+            _log("debug", "parsed %s inputs (%s lookups)", len(answers), lookups)
+
+        return answers
+
+    def expand_macro(self, name, depth, rng=None, dictionary=None, budget=None):
+        """
+        Expand macro `$name$` (the same as `parse("$name$")`, but via macro table).
+        Every expansion is a budget step.
+        """
+
+        if depth > self.MAX_PARSER_DEPTH:  # avoid infinite looping
+            _log("warning", "I went too deep (%s)", depth)
+            return self.EMPTY_RESPONSE
 
-        # postprocess answer
-        answer = self.process_answer(emo, entry, depth)
-        _log("debug", "parsed answer: `%s`", answer)
+        if dictionary is None:
+            dictionary = self.dictionary
 
-        return answer
+        if budget is not None:
+            budget.spend()
 
-    def process_answer(self, emo, entry, depth):
+        entry, emo = dictionary.lookup_macro(name)
+
+        if self.profiler is None:
+            return self.process_answer(emo, entry, depth, rng, dictionary, budget)
+
+        started = time.perf_counter()
+        output = self.process_answer(emo, entry, depth, rng, dictionary, budget)
+        self.profiler.add_macro(name, time.perf_counter() - started)
+        return output
+
+    def process_answer(self, emo, entry, depth, rng=None, dictionary=None, budget=None):
         """
         Entry answer processing.
         At the first step answer is selected randomly from the list
@@ -326,7 +1542,7 @@ class Delta:
             return self.EMPTY_RESPONSE
 
         # Get a random answer from the list.
-        answer = entry.get_answer(safe=(not SHELL_ALLOWED))
+        answer = entry.choose_answer(rng=rng)
 
         # Looking for marcos in the text. Every macro starts and ends
         # with the '$' sign. (e.g. '$macro$'). Expansion rules are stored
@@ -338,78 +1554,129 @@ class Delta:
         #
         # If dollar-sign '$' is needed in text it should be written
         # as three symbols -- '$$$'.
+        #
+        # Answer texts are split into templates at load time,
+        # shell and eval outputs are split here.
 
-        def _marco_parser(macromo, emo=emo):
-            macro_name = macromo.group(1)
-            if macro_name.isdigit():  # $1$
-                i = int(macro_name)
-                if i <= len(emo.groups()):
-                    return emo.group(i)
-                return self.EMPTY_RESPONSE
-            if macro_name == "$":  # $$$
-                return "$"
-            _log("debug", "expading macro `%s`", macro_name)
-            macro_expanded = self.parse(f"${macro_name}$", depth + 1)
-            return macro_expanded
+        if SHELL_ALLOWED and answer.action_type != Answer.TEXT:
+            template = _answer_template(answer.as_text(safe=False))
+        else:
+            template = answer.template
+
+        output = []
+        for kind, value in template:
+            if kind == Answer.CHUNK:
+                output.append(value)
+            elif kind == Answer.GROUP:  # $1$
+                if value <= len(emo.groups()):
+                    output.append(emo.group(value) or "")
+                else:
+                    output.append(self.EMPTY_RESPONSE)
+            else:
+                if DEBUG:
+                    _log("debug", "expading macro `%s`", value)
+                output.append(self.expand_macro(value, depth + 1, rng, dictionary, budget))
 
-        # magically replace all macros with
-        answer_expanded = MACROS_RE.sub(_marco_parser, answer)
+        return "".join(output)
 
-        return answer_expanded
 
+class DictionaryLoader:
+    """
+    XML dictionary loader: the file is read by chunks and parsed incrementally (expat),
+    entries are collected into a list. Broken entries are skipped and reported
+    with line numbers (see `errors`), XML syntax errors abort loading.
+    """
 
-class DeltaDictionaryXMLHandler(xml.sax.handler.ContentHandler):
-    """Content handlers for XML loader"""
+    CHUNK_SIZE = 1024 * 64  # file read size
 
-    text = ""  # current element text content
-    element_type = None  # current element type attribite
+    def __init__(self):
+        self.entries = []  # loaded entries (in file order)
+        self.errors = []  # (line, message) for skipped entries and ignored elements
+        self.entry = None  # current entry
+        self.entry_line = 0  # current entry start line
+        self.element_type = None  # current element type attribute
+        self.text = []  # current element text chunks
+
+        self.parser = xml.parsers.expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.buffer_size = self.CHUNK_SIZE
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+        self.parser.CharacterDataHandler = self.text.append
+
+    def load(self, infile):
+        """
+        Parse dictionary from binary file object.
+        Returns:
+            A list of loaded entries.
+        Raises:
+            xml.parsers.expat.ExpatError on XML syntax errors.
+        """
+        parse = self.parser.Parse
+        for chunk in iter(lambda: infile.read(self.CHUNK_SIZE), b""):
+            parse(chunk, False)
+        parse(b"", True)
+        return self.entries
 
-    def __init__(self, dictionary):
-        self.dictionary = dictionary
-        self.entry = None
-        super().__init__()
+    def error(self, message, line=None):
+        """report broken entry or element"""
+        self.errors.append((line or self.parser.CurrentLineNumber, message))
 
     # <element>
-    def startElement(self, name, attrs):
+    def start_element(self, name, attrs):
 
         if name == "entry":  # new entry
-            self.entry = DictionaryEntry()
             priority = attrs.get("pri", attrs.get("priority", 0))
-            self.entry.priority = _int(priority)
+            self.entry = DictionaryEntry(priority=_int(priority))
+            self.entry_line = self.parser.CurrentLineNumber
+            if _int(priority, None) is None:
+                self.error(f"bad entry priority `{priority}`, 0 is used")
 
         elif name in ["pattern", "answer"]:
             self.element_type = attrs.get("type")
 
+        # text content of the element only
+        self.text.clear()
+
     # </element>
-    def endElement(self, name):
+    def end_element(self, name):
+
+        entry = self.entry
 
-        if name == "entry":  # end of the entry — save it to dictionary
-            self.dictionary.append(self.entry)
+        if name == "entry":  # end of the entry — save it
+            if not entry.patterns:
+                self.error("entry without patterns skipped", self.entry_line)
+            elif not entry.answers:
+                self.error("entry without answers skipped", self.entry_line)
+            else:
+                self.entries.append(entry)
+            self.entry = None
+
+        elif name in ["pattern", "answer"] and entry is None:
+            self.error(f"<{name}> outside of <entry> ignored")
 
         elif name == "pattern":  # pattern
 
-            text = self.text.strip()
+            text = "".join(self.text).strip()
 
             if self.element_type == "macro":
-                self.entry.patterns.append(f"\\${text}\\$")
+                entry.patterns.append(f"\\${text}\\$")
+                entry.macros.append(text)
 
             elif self.element_type in ["exculsion", "exception", "exc"]:
-                self.entry.exclusions.append(text)
+                entry.exclusions.append(text)
 
             else:
-                self.entry.patterns.append(text)
+                entry.patterns.append(text)
 
         elif name == "answer":  # possible answer for the pattern
 
-            text = self.text.strip()
+            text = "".join(self.text).strip()
             answer = Answer(text=text, action_type=self.element_type)
-            self.entry.answers.append(answer)
+            entry.answers.append(answer)
 
         # clean up for the next element
-        self.text = ""
-
-    def characters(self, content):
-        self.text += content  # save element text content
+        self.text.clear()
 
 
 def _log(level, msg, *args, **kwargs):
@@ -430,3 +1697,228 @@ def _int(i, fallback=0):
         return int(i)
     except BaseException:
         return fallback
+
+
+def _answer_template(text):
+    """split answer text into template items (text chunks, `$1$` groups and `$name$` macros)"""
+
+    template = []
+    pos = 0
+
+    for macromo in MACROS_RE.finditer(text):
+        if macromo.start() > pos:
+            template.append((Answer.CHUNK, text[pos : macromo.start()]))
+        name = macromo.group(1)
+        if name.isdigit():
+            template.append((Answer.GROUP, int(name)))
+        else:
+            template.append((Answer.MACRO, name))
+        pos = macromo.end()
+
+    if pos < len(text):
+        template.append((Answer.CHUNK, text[pos:]))
+
+    return tuple(template)
+
+
+def _read_dictionary(filename, use_cache=False):
+    """
+    Read dictionary entries from XML file (or its cache file), patterns are not compiled.
+    Returns:
+        A tuple of entries list and broken entries list: (line, message).
+    Raises:
+        Exception if the file cannot be opened or parsed.
+    """
+
+    if use_cache:
+        cache_key = _cache_key(filename)
+        cached = _load_cache(filename + CACHE_SUFFIX, cache_key)
+        if cached is not None:
+            return cached
+
+    loader = DictionaryLoader()
+    with open(filename, "rb") as infile:
+        loader.load(infile)
+
+    if use_cache:
+        for entry in loader.entries:
+            entry.analyze_patterns()
+        _save_cache(filename + CACHE_SUFFIX, cache_key, loader.entries, loader.errors)
+
+    return (loader.entries, loader.errors)
+
+
+def _read_dictionary_task(task):
+    """
+    `load_dictionaries` task (runs in a pool process): read dictionary file
+    and analyze its patterns (compiled regexps can not be passed between processes),
+    returns (entries, broken entries, error message, seconds).
+    """
+    filename, use_cache = task
+    started = time.perf_counter()
+    # pylint: disable=broad-except
+    try:
+        entries, errors = _read_dictionary(filename, use_cache)
+        for entry in entries:
+            if entry.literals is None:
+                entry.analyze_patterns()
+    except Exception as exc:  # parser exceptions are not always picklable
+        return (None, None, str(exc) or repr(exc), time.perf_counter() - started)
+    return (entries, errors, None, time.perf_counter() - started)
+
+
+def _cache_key(filename):
+    """dictionary cache key: XML content hash, cache format and python (`re`) version"""
+    xhash = hashlib.sha256()
+    with open(filename, "rb") as infile:
+        for chunk in iter(lambda: infile.read(DictionaryLoader.CHUNK_SIZE), b""):
+            xhash.update(chunk)
+    return f"{xhash.hexdigest()}:{CACHE_VERSION}:{DictionaryEntry.re_flags}:{sys.version}"
+
+
+def _load_cache(filename, cache_key):
+    """load (entries, errors) from dictionary cache file, returns None if cache is missing or stale"""
+    # pylint: disable=broad-except
+    try:
+        with open(filename, "rb") as infile:
+            cache = pickle.load(infile)
+        if cache.get("key") == cache_key:
+            _log("debug", "loaded dictionary cache %s", filename)
+            return (cache["entries"], cache["errors"])
+        _log("info", "dictionary cache is stale %s", filename)
+    except FileNotFoundError:
+        pass
+    except Exception as exc:
+        _log("warning", "failed to load dictionary cache %s: %s", filename, exc)
+    return None
+
+
+def _save_cache(filename, cache_key, entries, errors):
+    """save entries and loader errors into dictionary cache file (atomically)"""
+    # pylint: disable=broad-except
+    tmpname = None
+    try:
+        dirname = os.path.dirname(os.path.abspath(filename))
+        with tempfile.NamedTemporaryFile("wb", dir=dirname, suffix=CACHE_SUFFIX, delete=False) as outfile:
+            tmpname = outfile.name
+            cache = {"key": cache_key, "entries": entries, "errors": errors}
+            pickle.dump(cache, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, filename)
+        _log("info", "saved dictionary cache %s", filename)
+    except Exception as exc:
+        _log("warning", "failed to save dictionary cache %s: %s", filename, exc)
+        if tmpname and os.path.exists(tmpname):
+            os.unlink(tmpname)
+
+
+def _shared(shared, value, key=None):
+    """returns the object equal to `value` (looked up by `key`) from the shared objects"""
+    return shared.setdefault(value if key is None else key, value)
+
+
+def _sizeof(obj, seen):
+    """deep size of dictionary objects in bytes, objects in `seen` are skipped (counted already)"""
+
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple)):
+        size += sum(_sizeof(x, seen) for x in obj)
+    elif isinstance(obj, dict):
+        size += sum(_sizeof(k, seen) + _sizeof(v, seen) for k, v in obj.items())
+    elif hasattr(obj, "__slots__"):
+        size += sum(_sizeof(getattr(obj, name, None), seen) for name in obj.__slots__)
+    elif hasattr(obj, "__dict__"):
+        size += _sizeof(obj.__dict__, seen)
+
+    return size
+
+
+def _fold(text):
+    """fold text case the same way as the `re` IGNORECASE mode does"""
+    folded = text.lower()
+    if len(folded) != len(text):  # `İ` is the only one with long lowercase
+        folded = text.replace("İ", "i").lower()
+    return folded.translate(FOLD_TABLE)
+
+
+def _has_groupref(items):
+    """check parsed pattern for backreferences"""
+    for op, av in items:
+        if op in (re_parser.GROUPREF, re_parser.GROUPREF_EXISTS, re_parser.GROUPREF_IGNORE):
+            return True
+        for arg in av if isinstance(av, (tuple, list)) else ():
+            if isinstance(arg, re_parser.SubPattern) and _has_groupref(arg):
+                return True
+            if isinstance(arg, list) and any(
+                isinstance(x, re_parser.SubPattern) and _has_groupref(x) for x in arg
+            ):
+                return True
+    return False
+
+
+def _parse_pattern(pattern, flags):
+    """
+    Parse pattern (the first half of the regexp compiler work),
+    returns a tuple of parsed pattern and error message (None if no errors).
+    """
+
+    try:
+        parsed = re_parser.parse(pattern, int(flags))  # plain int: `RegexFlag` operations are slow
+    except Exception as exc:  # pylint: disable=broad-except
+        return (None, str(exc))
+
+    def _lookbehind_error(items):  # the only error found by compiler after parsing
+        for op, av in items:
+            if op in (re_parser.ASSERT, re_parser.ASSERT_NOT) and av[0] < 0:
+                lo, hi = av[1].getwidth()
+                if lo != hi:
+                    return "look-behind requires fixed-width pattern"
+            for arg in av if isinstance(av, (tuple, list)) else ():
+                subs = arg if isinstance(arg, list) else [arg]
+                for sub in subs:
+                    if isinstance(sub, re_parser.SubPattern):
+                        error = _lookbehind_error(sub)
+                        if error is not None:
+                            return error
+        return None
+
+    return (parsed, _lookbehind_error(parsed))
+
+
+def _pattern_literals(parsed):
+    """
+    Extract literal strings required by the parsed pattern (folded to lower case).
+    Returns empty tuple if nothing is found.
+    """
+
+    if not parsed.state.flags & re.IGNORECASE.value:  # input may be not lowercased
+        return ()
+
+    literals = []
+
+    def _walk(items):
+        run = []
+        for op, av in items:
+            if op is re_parser.LITERAL:
+                char = chr(av).lower()
+                if len(char) == 1:
+                    run.append(char)
+                    continue
+            elif op is re_parser.AT:  # zero-width, does not break the run
+                continue
+            if run:
+                literals.append("".join(run))
+                run = []
+            if op is re_parser.SUBPATTERN and not av[1] and not av[2]:  # group without flags
+                _walk(av[3])
+            elif op in (re_parser.MAX_REPEAT, re_parser.MIN_REPEAT) and av[0] > 0:
+                _walk(av[2])
+        if run:
+            literals.append("".join(run))
+
+    _walk(parsed)
+
+    return tuple(x.translate(FOLD_TABLE) for x in literals)
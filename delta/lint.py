@@ -0,0 +1,529 @@
+"""
+delta lint -- dictionary checks (patterns are analyzed, compiled only to resolve macros or to fuzz)
+
+Checks:
+    regexp-error       -- pattern is broken and never matches
+    nested-quantifier  -- repeated group ends with a repeat overlapping its start: `(\\w+\\s?)+`
+                          (exponential backtracking on inputs which do not match)
+    overlapping-branch -- repeated alternation with branches starting with the same chars: `(\\w|\\d)+`
+                          (exponential backtracking)
+    quantifier-chain   -- overlapping repeats in a row followed by something which may fail: `\\w+\\s*\\w+$`
+                          (polynomial backtracking)
+    slow-pattern       -- pattern search on generated inputs took too long (with `fuzz`),
+                          error if the input is short
+    shadowed-entry     -- every input the entry matches is matched by entries tested before it
+    undefined-macro    -- `$name$` in answers expands to nothing
+    unreachable-macro  -- macro definition is never used: `$name$` is matched by an earlier entry
+    unused-macro       -- macro is defined, but never used in answers
+
+Usage example:
+
+    PYTHONPATH=. python -m delta.lint data/*.xml
+    PYTHONPATH=. python -m delta.lint --fuzz --json report.json data/dictionary-russian.xml
+
+"""
+
+import argparse
+import json
+import logging
+import re
+import string
+import sys
+import time
+
+from delta import delta
+
+__all__ = ["lint_dictionary", "lint_files", "format_issues", "fuzz_pattern"]
+
+re_parser = delta.re_parser
+
+RE_FLAGS = delta.DictionaryEntry.re_flags
+
+ERROR, WARNING = "error", "warning"
+
+REPEAT_LIMIT = 16  # repeats with greater max count are treated as unbounded
+
+FUZZ_MAX_LENGTH = 1024  # longest generated input
+FUZZ_THRESHOLD = 0.01  # seconds per search to report the pattern as slow
+FUZZ_LENGTHS = (4, 8, 12, 16, 20, 24, 32, 48, 64, 96, 128, 192, 256, 384, 512, 768, 1024, 2048, 4096)
+FUZZ_TAILS = ("!", "\x00")  # input endings which hardly match anything
+FUZZ_SHORT_INPUT = 64  # slow on inputs of this length or shorter -- error (likely exponential)
+
+# characters used to approximate character sets (inputs are lowercased, spaces are squeezed)
+ALPHABET = frozenset(
+    string.ascii_lowercase + string.digits + " _-.,:;!?$+*/()'\"\x00абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+)
+
+CATEGORIES = {
+    re_parser.CATEGORY_DIGIT: lambda x: x.isdigit(),
+    re_parser.CATEGORY_NOT_DIGIT: lambda x: not x.isdigit(),
+    re_parser.CATEGORY_SPACE: lambda x: x.isspace(),
+    re_parser.CATEGORY_NOT_SPACE: lambda x: not x.isspace(),
+    re_parser.CATEGORY_WORD: lambda x: x.isalnum() or x == "_",
+    re_parser.CATEGORY_NOT_WORD: lambda x: not (x.isalnum() or x == "_"),
+}
+
+POSSESSIVE_REPEAT = getattr(re_parser, "POSSESSIVE_REPEAT", None)  # python 3.11+
+ATOMIC_GROUP = getattr(re_parser, "ATOMIC_GROUP", None)  # python 3.11+
+REPEATS = tuple(x for x in (re_parser.MAX_REPEAT, re_parser.MIN_REPEAT, POSSESSIVE_REPEAT) if x)
+ZERO_WIDTH = (re_parser.AT, re_parser.ASSERT, re_parser.ASSERT_NOT)
+
+
+def lint_files(filenames, **kwargs):
+    """
+    Load dictionaries (as the engine does) and check them all together (see `lint_dictionary`).
+    Returns:
+        A list of issues.
+    """
+
+    engine = delta.Delta()
+    engine.dictionary.lazy_compile = True  # entries tried by macro lookups are compiled only
+    issues = []
+    for result in engine.load_dictionaries(filenames):
+        if result["error"] is not None:
+            issues.append(_issue("load-error", ERROR, result["filename"], None, None, result["error"]))
+
+    return issues + lint_dictionary(engine.dictionary, **kwargs)
+
+
+def lint_dictionary(dictionary, fuzz=False, max_length=FUZZ_MAX_LENGTH, threshold=FUZZ_THRESHOLD):
+    """
+    Check dictionary entries: patterns, shadowed entries and macros.
+    Args:
+        dictionary (Dictionary): loaded dictionary.
+        fuzz (bool, optional): time every pattern search on generated inputs (slow).
+        max_length (int, optional): longest generated input.
+        threshold (float, optional): seconds per search to report the pattern as slow.
+    Returns:
+        A list of issues (dicts): check, severity, file, entry, pattern and message.
+    """
+
+    entries = dictionary.entries
+    files = {entry: layer.name for layer in dictionary.layers for entry in layer.entries}
+    issues = []
+
+    for entry in entries:
+        issues.extend(check_patterns(entry, files.get(entry)))
+        if fuzz:
+            issues.extend(fuzz_entry(entry, files.get(entry), max_length, threshold))
+
+    issues.extend(check_shadowed(entries, files))
+    issues.extend(check_macros(dictionary, files))
+
+    return issues
+
+
+def check_patterns(entry, filename=None):
+    """regexp errors and backtracking risks of the entry patterns and exclusions"""
+
+    issues = []
+
+    for pattern in tuple(entry.patterns) + tuple(entry.exclusions):
+        parsed, error = delta._parse_pattern(pattern, entry.re_flags)  # pylint: disable=protected-access
+        if error is not None:
+            issues.append(_issue("regexp-error", ERROR, filename, entry, pattern, error))
+            continue
+        for check, severity, message in dict.fromkeys(_backtracking(parsed)):
+            issues.append(_issue(check, severity, filename, entry, pattern, message))
+
+    return issues
+
+
+def check_shadowed(entries, files=None):
+    """
+    Entries which never win: every pattern is covered by entries tested before
+    (without exclusions): the same pattern, a plain text pattern found in all its matches
+    or a pattern which matches anything.
+    """
+
+    files = files or {}
+    issues = []
+
+    catch_all = None  # the first entry matching anything
+    same = {}  # pattern => the first entry
+    plain = []  # (folded text, entry) of plain text patterns
+
+    for entry in entries:
+
+        if entry.literals is None:
+            entry.analyze_patterns()
+
+        covered = []
+        for pattern, literals in zip(entry.patterns, entry.literals, strict=True):
+            if literals is None:  # broken pattern (reported as `regexp-error`)
+                continue
+            by = catch_all or same.get(pattern)
+            if by is None:
+                by = next((x for text, x in plain if any(text in y for y in literals)), None)
+            covered.append(by)
+
+        if covered and all(covered):
+            message = "shadowed by " + ", ".join(sorted({str(x) for x in covered}))
+            issues.append(_issue("shadowed-entry", WARNING, files.get(entry), entry, None, message))
+
+        if entry.exclusions:  # excluded inputs are passed to the next entries
+            continue
+
+        for pattern, literals in zip(entry.patterns, entry.literals, strict=True):
+            if literals is None:
+                continue
+            same.setdefault(pattern, entry)
+            parsed, _ = delta._parse_pattern(pattern, entry.re_flags)  # pylint: disable=protected-access
+            if catch_all is None and _matches_anything(parsed):
+                catch_all = entry
+            elif len(literals) == 1 and all(op is re_parser.LITERAL for op, _ in parsed):
+                plain.append((literals[0], entry))
+
+    return issues
+
+
+def check_macros(dictionary, files=None):
+    """undefined, unreachable (defined by a shadowed entry) and unused macros"""
+
+    files = files or {}
+    issues = []
+
+    defined = {}  # lowercased name => defining entries
+    used = {}  # lowercased name => entries using it in answers
+    for entry in dictionary.entries:
+        for name in entry.macros:
+            defined.setdefault(name.lower(), []).append(entry)
+        for answer in entry.answers:
+            for kind, value in answer.template:
+                if kind == delta.Answer.MACRO:
+                    used.setdefault(value.lower(), []).append(entry)
+
+    for name, entries in used.items():
+        found, _ = dictionary.lookup_macro(name)
+        if found is None:
+            for entry in dict.fromkeys(entries):
+                message = f"`${name}$` is not defined"
+                issues.append(_issue("undefined-macro", WARNING, files.get(entry), entry, None, message))
+
+    for name, entries in defined.items():
+        found, _ = dictionary.lookup_macro(name)
+        for entry in entries:
+            if found is not entry:
+                message = f"`${name}$` matches {found}"
+                issues.append(_issue("unreachable-macro", WARNING, files.get(entry), entry, None, message))
+        if name not in used:
+            message = f"`${name}$` is not used"
+            issues.append(_issue("unused-macro", WARNING, files.get(entries[0]), entries[0], None, message))
+
+    return issues
+
+
+def fuzz_entry(entry, filename=None, max_length=FUZZ_MAX_LENGTH, threshold=FUZZ_THRESHOLD):
+    """time patterns and exclusions of the entry on generated inputs, slow patterns are reported"""
+
+    issues = []
+
+    for pattern in tuple(entry.patterns) + tuple(entry.exclusions):
+        seconds, inline = fuzz_pattern(pattern, entry.re_flags, max_length, threshold)
+        if seconds > threshold:
+            message = f"search took {seconds:.3f}s on {len(inline)} chars `{inline[:20]}…`"
+            severity = ERROR if len(inline) <= FUZZ_SHORT_INPUT else WARNING
+            issues.append(_issue("slow-pattern", severity, filename, entry, pattern, message))
+
+    return issues
+
+
+def fuzz_pattern(pattern, flags=RE_FLAGS, max_length=FUZZ_MAX_LENGTH, threshold=FUZZ_THRESHOLD):
+    """
+    Search the pattern in generated inputs of growing length: runs of characters
+    the pattern repeats and its literals, followed by a character which hardly matches.
+    Growing stops as soon as a search takes longer than `threshold`.
+    Returns:
+        A tuple of the longest search time (seconds) and its input (broken pattern -- zero time).
+    """
+
+    parsed, error = delta._parse_pattern(pattern, flags)  # pylint: disable=protected-access
+    if error is not None:
+        return (0.0, "")
+    compiled = re.compile(pattern, flags)
+
+    literals = delta._pattern_literals(parsed)  # pylint: disable=protected-access
+    samples = {"a", " ", "1", "а", "a "}
+    samples.update(" ".join(literals[:num]) + " " for num in range(1, len(literals) + 1))
+    samples.update(literal + " " for literal in literals)
+    for chars in _char_sets(parsed):
+        samples.add(min(chars, key=lambda x: (not x.isalpha(), x)))
+
+    clock = time.perf_counter
+    worst = (0.0, "")
+
+    for sample in sorted(samples):
+        for tail in FUZZ_TAILS:
+            for length in FUZZ_LENGTHS:
+                if length > max_length:
+                    break
+                inline = delta.SPACES_RE.sub(" ", (sample * (length // len(sample) + 1))[:length] + tail)
+                started = clock()
+                compiled.search(inline)
+                seconds = clock() - started
+                if seconds > worst[0]:
+                    worst = (seconds, inline)
+                if seconds > threshold:
+                    break
+
+    return worst
+
+
+def format_issues(issues):
+    """text report (one line for every issue)"""
+
+    lines = []
+    for issue in issues:
+        where = f"{issue['file'] or '-'}: {issue['entry'] or ''}"
+        pattern = f" `{issue['pattern']}`" if issue["pattern"] is not None else ""
+        lines.append(f"{where}: {issue['severity']}: {issue['check']}:{pattern} {issue['message']}")
+
+    errors = sum(x["severity"] == ERROR for x in issues)
+    lines.append(f"{len(issues)} issues ({errors} errors)")
+
+    return "\n".join(lines)
+
+
+def _issue(check, severity, filename, entry, pattern, message):
+    """issue record"""
+    return {
+        "check": check,
+        "severity": severity,
+        "file": filename,
+        "entry": entry and str(entry),
+        "pattern": pattern,
+        "message": message,
+    }
+
+
+def _chars(op, av):
+    """characters (of ALPHABET) matched by single character item, None for other items"""
+
+    if op is re_parser.LITERAL:
+        return frozenset((chr(av).lower(),)) & ALPHABET
+    if op is re_parser.NOT_LITERAL:
+        return ALPHABET - {chr(av).lower()}
+    if op is re_parser.ANY:
+        return ALPHABET
+    if op is not re_parser.IN:
+        return None
+
+    negate = False
+    tests = []
+    for kind, value in av:
+        if kind is re_parser.NEGATE:
+            negate = True
+        elif kind is re_parser.LITERAL:
+            tests.append(lambda x, code=value: ord(x) == code)
+        elif kind is re_parser.RANGE:
+            tests.append(lambda x, bounds=value: bounds[0] <= ord(x) <= bounds[1])
+        elif kind is re_parser.CATEGORY:
+            tests.append(CATEGORIES.get(value, lambda x: True))
+        else:  # unknown -- anything
+            tests.append(lambda x: True)
+
+    return frozenset(x for x in ALPHABET if any(test(x) for test in tests) != negate)
+
+
+def _char_sets(items):
+    """sets of characters of all single character items (not empty)"""
+    for op, av in items:
+        chars = _chars(op, av)
+        if chars:
+            yield chars
+        for sub in _children(op, av):
+            yield from _char_sets(sub)
+
+
+def _children(op, av):
+    """nested item lists of the item"""
+
+    if op is re_parser.SUBPATTERN:
+        return [av[-1]]
+    if op is re_parser.BRANCH:
+        return av[1]
+    if op in REPEATS:
+        return [av[2]]
+    if op in (re_parser.ASSERT, re_parser.ASSERT_NOT):
+        return [av[1]]
+    if op is ATOMIC_GROUP:
+        return [av]
+    if op is re_parser.GROUPREF_EXISTS:
+        return [x for x in av[1:] if x is not None]
+    return []
+
+
+def _nullable(items):
+    """items may match an empty string"""
+    return all(_nullable_item(op, av) for op, av in items)
+
+
+def _nullable_item(op, av):
+    """item may match an empty string"""
+    if op in ZERO_WIDTH or op in (re_parser.GROUPREF, re_parser.GROUPREF_EXISTS):
+        return True
+    if op in REPEATS:
+        return av[0] == 0 or _nullable(av[2])
+    if op is re_parser.BRANCH:
+        return any(_nullable(x) for x in av[1])
+    if op in (re_parser.SUBPATTERN, ATOMIC_GROUP):
+        return all(_nullable(x) for x in _children(op, av))
+    return False
+
+
+def _first(items):
+    """characters the match of items may start with"""
+
+    first = set()
+    for op, av in items:
+        chars = _chars(op, av)
+        if chars is not None:
+            first |= chars
+        elif op in (re_parser.GROUPREF, re_parser.GROUPREF_EXISTS):
+            first |= ALPHABET
+        elif op not in ZERO_WIDTH:
+            for sub in _children(op, av):
+                first |= _first(sub)
+        if not _nullable_item(op, av):
+            break
+
+    return first
+
+
+def _consumed(items):
+    """all characters the match of items may contain"""
+
+    consumed = set()
+    for op, av in items:
+        chars = _chars(op, av)
+        if chars is not None:
+            consumed |= chars
+        elif op is re_parser.GROUPREF:
+            consumed |= ALPHABET
+        elif op not in ZERO_WIDTH:
+            for sub in _children(op, av):
+                consumed |= _consumed(sub)
+
+    return consumed
+
+
+def _unbounded(op, av):
+    """item is a repeat of many (not possessive) matches"""
+    return op in (re_parser.MAX_REPEAT, re_parser.MIN_REPEAT) and av[1] > REPEAT_LIMIT
+
+
+def _tail_repeats(items):
+    """unbounded repeats the match of items may end with (only nullable items after them)"""
+
+    found = []
+    for op, av in reversed(items):
+        if _unbounded(op, av):
+            found.append(_consumed(av[2]))
+        elif op is re_parser.SUBPATTERN or op is re_parser.BRANCH:
+            for sub in _children(op, av):
+                found.extend(_tail_repeats(sub))
+        if not _nullable_item(op, av):
+            break
+
+    return found
+
+
+def _backtracking(items):
+    """
+    Backtracking risks of parsed pattern: (check, severity, message) for every found risk.
+    Sets of matched characters are approximated by ALPHABET.
+    """
+
+    risks = []
+
+    # repeated group which may be split into iterations in many ways
+    for op, av in items:
+        if _unbounded(op, av):
+            body = av[2]
+            first = _first(body)
+            if _nullable(body):
+                risks.append(("nested-quantifier", ERROR, "repeated group may match empty string"))
+            elif any(first & x for x in _tail_repeats(body)):
+                message = "repeated group ends with repeat of its first chars"
+                risks.append(("nested-quantifier", ERROR, message))
+            else:
+                while len(body) == 1 and body[0][0] is re_parser.SUBPATTERN:
+                    body = body[0][1][-1]
+                branches = body[0][1][1] if len(body) == 1 and body[0][0] is re_parser.BRANCH else []
+                starts = [_first(x) for x in branches]
+                if any(x & y for num, x in enumerate(starts) for y in starts[num + 1 :]):
+                    risks.append(("overlapping-branch", ERROR, "repeated alternation branches start alike"))
+
+        for sub in _children(op, av):
+            risks.extend(_backtracking(sub))
+
+    # overlapping repeats in a row (each of them may take any share of the input)
+    chain = []  # (consumed characters, chain length) of repeats which may continue
+    for op, av in items:
+        if _unbounded(op, av):
+            consumed = _consumed(av[2])
+            length = 1 + max((num for chars, num in chain if chars & consumed), default=0)
+            chain.append((consumed, length))
+        elif op is re_parser.AT or not _nullable_item(op, av):  # may fail
+            length = max((num for _, num in chain), default=0)
+            if length > 1:
+                risks.append(("quantifier-chain", WARNING, f"{length} overlapping repeats in a row"))
+                chain = []
+                continue
+            consumed = _consumed([(op, av)])
+            chain = [(chars, num) for chars, num in chain if consumed <= chars]
+
+    return risks
+
+
+def _matches_anything(parsed):
+    """pattern matches any input (may match empty string and has no assertions)"""
+
+    def _plain(items):
+        for op, av in items:
+            if op in ZERO_WIDTH or op in (re_parser.GROUPREF, re_parser.GROUPREF_EXISTS):
+                return False
+            if not all(_plain(x) for x in _children(op, av)):
+                return False
+        return True
+
+    return parsed is not None and _nullable(parsed) and _plain(parsed)
+
+
+def main():
+    """check dictionaries from command line, exit code 1 if any errors are found"""
+
+    parser = argparse.ArgumentParser(description="delta dictionary lint")
+    parser.add_argument(
+        "--fuzz", action="store_true", default=False, help="time pattern search on generated inputs"
+    )
+    parser.add_argument("--max-length", type=int, default=FUZZ_MAX_LENGTH, help="fuzz: longest input")
+    parser.add_argument("--threshold", type=float, default=FUZZ_THRESHOLD, help="fuzz: slow search seconds")
+    parser.add_argument("--json", type=str, metavar="FILE", help="save issues (JSON, `-` -- stdout)")
+    parser.add_argument("--quiet", "-q", action="store_true", default=False, help="no text report")
+    parser.add_argument("dictionary", nargs="+", help="XML dictionary")
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format="%(levelname)s %(module)s: %(message)s")
+    delta.logger = logging.getLogger("delta")
+
+    issues = lint_files(args.dictionary, fuzz=args.fuzz, max_length=args.max_length, threshold=args.threshold)
+
+    if not args.quiet:
+        print(format_issues(issues))
+
+    if args.json:
+        with open(
+            sys.stdout.fileno() if args.json == "-" else args.json,
+            "w",
+            encoding="utf-8",
+            closefd=args.json != "-",
+        ) as outfile:
+            json.dump(issues, outfile, ensure_ascii=False, indent=1)
+            outfile.write("\n")
+
+    return 1 if any(x["severity"] == ERROR for x in issues) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,14 @@
 """delta basic tests"""
 
 import logging
+import os
+import shutil
 import sys
+import tempfile
 import unittest
+import unittest.mock
 
-from delta import delta
+from delta import delta, lint, metrics
 
 TEST_DICTIONARY = "data/dictionary-test.xml"
 
@@ -80,6 +84,245 @@ class TestDelta(unittest.TestCase):
         self.assertEqual(len(self.delta.dictionary), 0)
         self.assertEqual(excepted, True)
 
+    def test_11_load_broken_entries(self):
+        """test broken entries are skipped and reported with line numbers"""
+
+        delta.logger = unittest.mock.Mock()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "dictionary.xml")
+            with open(filename, "w", encoding="utf-8") as outfile:
+                outfile.write(
+                    "<dictionary>\n"
+                    "<entry><patterns><pattern>hallo</pattern></patterns></entry>\n"
+                    "<answer>lost</answer>\n"
+                    "<entry priority='high'>\n"
+                    "<patterns><pattern>hallo</pattern><pattern type='exc'>bye</pattern></patterns>\n"
+                    "<answers><answer>he&amp;llo</answer></answers>\n"
+                    "</entry>\n"
+                    "</dictionary>\n"
+                )
+
+            self.assertEqual(self.delta.load_dictionary(filename), 1)
+
+        errors = [x.args[1:] for x in delta.logger.error.call_args_list]
+        self.assertEqual([x[1] for x in errors], [2, 3, 4])
+        self.assertTrue(all(x[0] == filename for x in errors))
+        self.assertEqual(self.delta.parse("hallo"), "he&llo")
+        self.assertEqual(self.delta.parse("hallo, bye"), "")
+
+    def test_12_dictionary_cache(self):
+        """test loading dictionary via cache file"""
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "dictionary.xml")
+            shutil.copy(TEST_DICTIONARY, filename)
+
+            # no cache -- build it
+            count = self.delta.load_dictionary(filename, use_cache=True)
+            self.assertTrue(os.path.exists(filename + delta.CACHE_SUFFIX))
+
+            # fresh cache
+            cached = delta.Delta()
+            self.assertEqual(cached.load_dictionary(filename, use_cache=True), count)
+            self.assertEqual(
+                [x.patterns for x in cached.dictionary.entries],
+                [x.patterns for x in self.delta.dictionary.entries],
+            )
+            self.assertTrue(cached.parse("$numbers$").isdigit())
+
+            # stale cache -- rebuild
+            with open(filename, encoding="utf-8") as infile:
+                data = infile.read().replace("what time", "what date")
+            with open(filename, "w", encoding="utf-8") as outfile:
+                outfile.write(data)
+            rebuilt = delta.Delta()
+            rebuilt.load_dictionary(filename, use_cache=True)
+            self.assertIn("what date", [x.patterns[0] for x in rebuilt.dictionary.entries])
+
+    def test_13_lazy_compile(self):
+        """test lazy patterns compilation"""
+
+        self.delta.dictionary.lazy_compile = True
+        delta.logger = unittest.mock.Mock()
+
+        entry = delta.DictionaryEntry(patterns=[r"(?<=a+)b", "hallo"], answers=[delta.Answer(text="hi")])
+        self.delta.dictionary.append(entry)
+        self.assertFalse(entry.compiled)
+        self.assertEqual(delta.logger.error.call_count, 1)  # reported at load time
+
+        self.delta.load_dictionary(TEST_DICTIONARY)
+        self.assertEqual(delta.logger.error.call_count, 2)  # + TEST ERROR PATTERN
+        self.assertFalse(any(x.compiled for x in self.delta.dictionary.entries))
+
+        self.assertEqual(self.delta.parse("hallo"), "hi")
+        self.assertTrue(entry.compiled)
+
+        self.delta.warm_up(background=True).join()
+        self.assertTrue(all(x.compiled for x in self.delta.dictionary.entries))
+        self.assertTrue(self.delta.parse("$numbers$").isdigit())
+
+    def test_14_macro_table(self):
+        """test macro expansion via macro table"""
+
+        self.test_10_load_dictionary()
+
+        self.assertIn("$numbers$", self.delta.dictionary.macros)
+        for name in ("number", "numbers", "NUMBER", "unknown"):
+            entry, emo = self.delta.dictionary.lookup_macro(name)
+            expected, xmo = self.delta.dictionary.lookup(f"${name}$".lower())
+            self.assertIs(entry, expected)
+            self.assertEqual(emo and emo.span(), xmo and xmo.span())
+
+        # non-macro pattern matching `$name$`
+        entry = delta.DictionaryEntry(patterns=[r"\$sign\$"], answers=[delta.Answer(text="$$$")], priority=1)
+        self.delta.dictionary.append(entry)
+        entry = delta.DictionaryEntry(patterns=["signs"], answers=[delta.Answer(text="<$sign$>")], priority=1)
+        self.delta.dictionary.append(entry)
+        self.delta.dictionary.sort()
+        self.assertEqual(self.delta.parse("signs"), "<$$$>")
+
+        # infinite macro loop
+        entry = delta.DictionaryEntry(patterns=[r"\$loop\$", "loop"], answers=[delta.Answer(text="+$loop$")])
+        entry.priority = 1
+        self.delta.dictionary.append(entry)
+        self.delta.dictionary.sort()
+        self.assertEqual(self.delta.parse("loop"), "+" * (self.delta.MAX_PARSER_DEPTH + 1))
+
+    def test_15_answer_template(self):
+        """test answer templates expansion"""
+
+        self.delta.EMPTY_RESPONSE = "?"
+
+        answer = delta.Answer(text="[$0$|$1$|$2$|$3$] $$$ $$$x$ $4 $_$")
+        self.assertEqual(answer.template[:3], ((answer.CHUNK, "["), (answer.GROUP, 0), (answer.CHUNK, "|")))
+
+        entry = delta.DictionaryEntry(patterns=[r"(\d+)(x)?"], answers=[answer])
+        self.delta.dictionary.append(entry)
+
+        self.assertEqual(self.delta.parse("abc 42 def"), "[42|42||?] $$$ $$? $4 ?")
+
+    def test_16_compact_entries(self):
+        """test compact entries: tuples, slots and objects shared between entries"""
+
+        self.test_10_load_dictionary()
+        report = self.delta.dictionary.memory_report()
+        self.assertEqual(report["entries"], len(self.delta.dictionary))
+        self.assertTrue(report["bytes_per_entry"] > 0)
+
+        # the same entries twice in one file -- everything is shared but entries themselves
+        with open(TEST_DICTIONARY, encoding="utf-8") as infile:
+            data = infile.read()
+        start, end = data.index("<entry"), data.rindex("</entry>") + len("</entry>")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "dictionary.xml")
+            with open(filename, "w", encoding="utf-8") as outfile:
+                outfile.write(data[:end] + data[start:])
+            self.delta = delta.Delta()
+            self.delta.load_dictionary(filename)
+
+        entries = self.delta.dictionary.entries
+        self.assertTrue(self.delta.dictionary.memory_report()["bytes"] < 2 * report["bytes"])
+
+        for entry in entries:
+            self.assertFalse(hasattr(entry, "__dict__"))
+            self.assertIsInstance(entry.patterns, tuple)
+            self.assertIsInstance(entry.answers, tuple)
+            self.assertIsInstance(entry.patterns_cmp, tuple)
+
+        twins = [(x, y) for x in entries for y in entries if x is not y and x.patterns == y.patterns]
+        self.assertTrue(twins)
+        for entry, twin in twins:
+            self.assertIs(entry.patterns, twin.patterns)
+            self.assertIs(entry.answers, twin.answers)
+
+        self.assertTrue(self.delta.parse("$numbers$").isdigit())
+
+    def test_17_reload_dictionaries(self):
+        """test atomic dictionaries reload"""
+
+        self.delta.cache = delta.LookupCache(10)
+        self.test_10_load_dictionary()
+        old = self.delta.dictionary
+        self.assertIn("what time", self.delta.parse_entry("what time")[1].patterns)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "dictionary.xml")
+            with open(TEST_DICTIONARY, encoding="utf-8") as infile:
+                data = infile.read()
+
+            # broken XML -- old dictionary stays
+            with open(filename, "w", encoding="utf-8") as outfile:
+                outfile.write(data[: len(data) // 2])
+            with self.assertRaises(RuntimeError):
+                self.delta.reload_dictionaries([TEST_DICTIONARY, filename])
+            self.assertIs(self.delta.dictionary, old)
+
+            # fixed XML -- new dictionary, no stale lookups from cache
+            with open(filename, "w", encoding="utf-8") as outfile:
+                outfile.write(data.replace("what time", "what date"))
+            new = self.delta.load_new_dictionary([filename])
+            self.assertIs(self.delta.dictionary, old)
+            self.assertGreater(new.version, old.version)
+            self.assertEqual(self.delta.reload_dictionaries([filename]), len(old))
+            self.assertIsNot(self.delta.dictionary, old)
+            self.assertNotIn("what time", self.delta.parse_entry("what time")[1].patterns)
+            self.assertIn("what date", self.delta.parse_entry("what date")[1].patterns)
+
+    def test_18_dictionary_layers(self):
+        """test dictionary layers: lookup result is the same as for one list sorted by priority"""
+
+        self.test_10_load_dictionary()
+        base = self.delta.dictionary.layers[0]
+        index = base.index
+
+        def _entry(pattern, answer, priority):
+            answers = [delta.Answer(text=answer)]
+            return delta.DictionaryEntry(patterns=[pattern], answers=answers, priority=priority)
+
+        top = max(x.priority for x in base.entries)
+        self.delta.dictionary.add_layer(
+            [_entry("time", "tie", 0), _entry("hallo", "overlay", top + 1), _entry("2", "two", 0)],
+            name="overlay",
+        )
+        self.delta.dictionary.build_index()
+        self.assertIs(base.index, index)  # old layer is not rebuilt
+
+        say_this = ["2+2", "what time?", "time", "hallo", "2", "$numbers$", "", "?"]
+        for use_combined in (False, True):
+            self.delta.dictionary.use_combined = use_combined
+            flat = self.delta.dictionary.entries
+            for inline in say_this:
+                expected = next((x for x in flat if x.match(inline)), None)
+                self.assertIs(self.delta.dictionary.lookup(inline)[0], expected, inline)
+
+        self.assertEqual(self.delta.parse("hallo"), "overlay")
+        self.assertNotEqual(self.delta.parse("what time"), "tie")  # earlier layer wins
+
+        count = len(self.delta.dictionary)
+        self.assertEqual(self.delta.unload_dictionary("overlay"), count - 3)
+        self.assertNotEqual(self.delta.parse("hallo"), "overlay")
+
+    def test_19_load_dictionaries(self):
+        """test parallel loading: the same dictionary as after sequential loading"""
+
+        dicts = sorted(os.path.join("data", x) for x in os.listdir("data") if x.endswith(".xml"))
+        for dct in dicts:
+            self.delta.load_dictionary(dct)
+
+        loaded = delta.Delta()
+        report = loaded.load_dictionaries(dicts + ["/_nonexistent_/" + TEST_DICTIONARY], workers=2)
+        self.assertEqual([x["filename"] for x in report[:-1]], dicts)
+        self.assertTrue(all(x["error"] is None and x["seconds"] >= 0 for x in report[:-1]))
+        self.assertIsNotNone(report[-1]["error"])
+        self.assertEqual(sum(x["entries"] for x in report), len(self.delta.dictionary))
+
+        self.assertEqual(
+            [(x.priority, x.patterns) for x in loaded.dictionary.entries],
+            [(x.priority, x.patterns) for x in self.delta.dictionary.entries],
+        )
+        self.assertTrue(loaded.parse("$numbers$").isdigit())
+
     def test_20_say_something(self):
         """test that delta does reply with something"""
 
@@ -102,6 +345,107 @@ class TestDelta(unittest.TestCase):
         logging.info("\n> %s\n< %s", numbers, say_numbers)
         self.assertTrue(say_numbers.isdigit())
 
+    def test_21_parse_many(self):
+        """test batch parsing"""
+
+        self.test_10_load_dictionary()
+
+        say_this = ["ghbdtn", "2+2", "  2+2 ", "$numbers$", "", "what time is it?", "2+2"] * 10
+
+        answers = self.delta.parse_many(say_this, seed=42)
+        self.assertEqual(len(answers), len(say_this))
+        self.assertEqual(answers, self.delta.parse_many(say_this, seed=42))
+        self.assertEqual(answers[0], self.delta.parse("ghbdtn"))
+        self.assertTrue(all(x.startswith("4, but sometimes ") for x in answers[1::7]))
+        self.assertTrue(all(x.isdigit() for x in answers[3::7]))
+        self.assertEqual(self.delta.parse_many([]), [])
+
+    def test_22_lookup_cache(self):
+        """test LRU lookup cache"""
+
+        self.delta.cache = delta.LookupCache(2)
+        self.test_10_load_dictionary()
+
+        numbers = {self.delta.parse("2+3") for _ in range(20)}
+        self.assertTrue(len(numbers) > 1)  # answers are still random
+        self.assertEqual(self.delta.cache.stats()["misses"], 1)
+        self.assertEqual(self.delta.cache.stats()["hits"], 19)
+
+        self.delta.parse("what time")
+        self.delta.parse("ghbdtn")
+        self.delta.parse("2+3")
+        self.assertEqual(self.delta.cache.stats()["evictions"], 2)
+        self.assertEqual(self.delta.cache.stats()["misses"], 4)
+
+        # new entries -- cache is invalidated
+        entry = delta.DictionaryEntry(patterns=[r"\+3"], answers=[delta.Answer(text="3!")], priority=100)
+        self.delta.dictionary.append(entry)
+        self.delta.dictionary.sort()
+        self.assertEqual(self.delta.parse("2+3"), "3!")
+        self.assertEqual(self.delta.cache.stats()["size"], 1)
+
+    def test_23_profiler(self):
+        """test per entry and per pattern profiling"""
+
+        self.test_10_load_dictionary()
+        say_this = ["ghbdtn", "2+2", "what time is it?", "whoo-hoo", "$numbers$", ""]
+        expected = [self.delta.parse_entry(x)[1] for x in say_this]
+
+        self.delta.profiler = delta.Profiler()
+        for use_combined in (False, True):
+            self.delta.dictionary.use_combined = use_combined
+            self.assertEqual([self.delta.parse_entry(x)[1] for x in say_this], expected)
+
+        report = self.delta.profiler.report(self.delta.dictionary)
+        self.assertEqual(report["lookups"], len(say_this) * 2)
+        self.assertIn("number", report["macros"])
+
+        stats = {x["entry"]: x for x in report["entries"]}
+        time_entry = stats[str(self.delta.parse_entry("what time")[1])]
+        self.assertEqual(time_entry["matches"], 2)
+        self.assertEqual(sum(x["matches"] for x in time_entry["patterns"]), 2)
+        self.assertTrue(time_entry["seconds"] > 0)
+        self.assertTrue(set(report["never_matched"]) >= set(report["never_evaluated"]))
+        self.assertNotIn(str(time_entry["entry"]), report["never_matched"])
+
+        self.assertIn("lookups: 12", delta.Profiler.format_report(report))
+
+    def test_24_budget(self):
+        """test request time and step budgets and input truncation"""
+
+        self.test_10_load_dictionary()
+        say_this = ["ghbdtn", "2+2", "what time is it?", "whoo-hoo", "$numbers$", ""]
+        expected = [self.delta.parse_entry(x)[1] for x in say_this]
+
+        # enough budget -- the same entries
+        self.delta.STEP_BUDGET = 1000
+        self.delta.TIME_BUDGET = 60
+        self.assertEqual([self.delta.parse_entry(x)[1] for x in say_this], expected)
+        self.assertEqual(self.delta.exceeded, {"time": 0, "steps": 0})
+
+        # one regexp and 3 macros in the answer
+        entry = delta.DictionaryEntry(patterns=["count"], priority=20)
+        entry.answers = [delta.Answer(text="$number$, $number$, $number$")]
+        self.delta.dictionary.append(entry)
+        self.delta.dictionary.sort()
+        self.delta.STEP_BUDGET = 4
+        self.assertEqual(self.delta.parse_entry("count")[1], entry)
+        self.delta.STEP_BUDGET = 3
+        self.assertEqual(self.delta.parse_entry("count"), ("", None))
+        self.delta.BUDGET_RESPONSE = "busy"
+        self.delta.STEP_BUDGET = 2  # the second input is not looked up again
+        self.assertEqual(self.delta.parse_many(["count", "count"]), ["busy", "busy"])
+        self.assertEqual(self.delta.exceeded, {"time": 0, "steps": 3})
+
+        self.delta.STEP_BUDGET = 0
+        self.delta.TIME_BUDGET = 1e-9
+        self.assertEqual(self.delta.parse("count"), "busy")
+        self.assertEqual(self.delta.exceeded, {"time": 1, "steps": 3})
+
+        self.delta.TIME_BUDGET = 0
+        self.delta.INPUT_MAXSIZE = 4
+        self.assertEqual(self.delta.parse("WHAT time"), "hallo?")
+
     def test_30_run_some_code_disabled(self):
         """test that delta runs a code when SHELL disabled"""
 
@@ -136,6 +480,143 @@ class TestDelta(unittest.TestCase):
         logging.info("\n> %s\n< %s", evalme, say_evalme)
         self.assertTrue(say_evalme.isdigit())
 
+    def test_40_lookup_index(self):
+        """test that literal prefilter index does not change lookup results"""
+
+        self.test_10_load_dictionary()
+
+        entry = delta.DictionaryEntry(patterns=[r"\bсоль\b", r"(ab)+c", r"x|y"], priority=1)
+        entry.answers = [delta.Answer(text="found")]
+        self.delta.dictionary.append(entry)
+        self.delta.dictionary.sort()
+
+        entry.analyze_patterns()
+        self.assertEqual(entry.literals, (("соль",), ("ab", "c"), ()))
+
+        say_this = ["2+2", "12+4", "what time?", "", "$numbers$", "СОЛЬ", "ᲃоль", "xyz", "ababc", "?"]
+        for inline in say_this:
+            self.delta.dictionary.use_index = False
+            expected = self.delta.dictionary.lookup(inline)
+            self.delta.dictionary.use_index = True
+            found = self.delta.dictionary.lookup(inline)
+            self.assertIs(found[0], expected[0], inline)
+
+        self.assertEqual(self.delta.parse("ᲃоль"), "found")
+
+    def test_41_lookup_combined(self):
+        """test that combined alternation matcher does not change lookup results"""
+
+        self.test_10_load_dictionary()
+
+        entry = delta.DictionaryEntry(patterns=[r"(\w)\1(\w+)"], priority=1)
+        entry.answers = [delta.Answer(text="double $1$ and $2$")]
+        self.delta.dictionary.append(entry)
+        entry = delta.DictionaryEntry(patterns=[r"(?P<say>hey) (\w+)"], exclusions=["you"], priority=1)
+        entry.answers = [delta.Answer(text="$2$!")]
+        self.delta.dictionary.append(entry)
+        self.delta.dictionary.sort()
+
+        say_this = ["2+2", "12+4", "what time?", "", "$numbers$", "aab", "hey there", "hey you", "?"]
+        for inline in say_this:
+            self.delta.dictionary.use_combined = False
+            expected = self.delta.dictionary.lookup(inline)
+            self.delta.dictionary.use_combined = True
+            found = self.delta.dictionary.lookup(inline)
+            self.assertIs(found[0], expected[0], inline)
+            self.assertEqual(found[1] and found[1].groups(), expected[1] and expected[1].groups())
+
+        self.assertEqual(len(self.delta.dictionary.layers[0].matcher.singles), 0)
+        self.assertEqual(len(self.delta.dictionary.layers[1].matcher.singles), 2)
+        self.assertEqual(self.delta.parse("xxyz"), "double x and yz")
+        self.assertEqual(self.delta.parse("hey there"), "there!")
+        self.assertTrue(self.delta.parse("12+4").startswith("12+4="))
+
+    def test_50_metrics(self):
+        """test metrics registry and Prometheus text format"""
+
+        registry = metrics.Registry()
+        requests = registry.counter("delta_requests_total", "requests")
+        active = registry.gauge("delta_active", "active")
+        errors = registry.counter("delta_errors_total", "errors", {"kind": 'bad "one"'})
+        registry.gauge("delta_entries", "entries", func=lambda: 42)
+        latency = registry.histogram("delta_seconds", "latency", buckets=(0.1, 1))
+
+        requests.inc()
+        requests.inc(2)
+        errors.inc()
+        for value in (0.05, 0.1, 0.5, 5):
+            latency.observe(value)
+
+        lines = registry.render().splitlines()
+        self.assertIn("# TYPE delta_requests_total counter", lines)
+        self.assertIn("delta_requests_total 3", lines)
+        self.assertIn('delta_errors_total{kind="bad \\"one\\""} 1', lines)
+        self.assertIn("delta_entries 42", lines)
+        self.assertIn('delta_seconds_bucket{le="0.1"} 2', lines)
+        self.assertIn('delta_seconds_bucket{le="1"} 3', lines)
+        self.assertIn('delta_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn("delta_seconds_sum 5.65", lines)
+        self.assertIn("delta_seconds_count 4", lines)
+
+        # forked workers write their own rows, parent renders the sum
+        if not hasattr(os, "fork"):
+            return
+        registry.share(2)
+        for slot in (0, 1, 0):  # the last one replaces the dead worker of slot 0
+            pid = os.fork()
+            if pid == 0:  # worker
+                registry.attach(slot)
+                requests.inc(10)
+                active.inc()
+                latency.observe(0.5)
+                os._exit(0)  # pylint: disable=protected-access
+            os.waitpid(pid, 0)
+
+        lines = registry.render().splitlines()
+        self.assertIn("delta_requests_total 33", lines)
+        self.assertIn("delta_active 2", lines)  # gauge of the dead worker is reset
+        self.assertIn('delta_seconds_bucket{le="1"} 6', lines)
+        self.assertIn("delta_seconds_count 7", lines)
+
+    def test_51_lint(self):
+        """test dictionary lint checks"""
+
+        entries = [
+            (["hello"], "$greeting$ $nothing$", [], 1),
+            (["hello there", "well hello"], "shadowed", [], 0),
+            ([r"(\w+\s?)+$"], "nested", [], 0),
+            ([r"(\w|-?\d)+x"], "branches", [], 0),
+            ([r"\w+\s*\w+$"], "chain", [], 0),
+            ([r"\$greeting\$"], "hi", ["greeting"], 0),
+            ([r"\$spare\$"], "unused", ["spare"], 0),
+        ]
+        for patterns, answer, macros, priority in entries:
+            entry = delta.DictionaryEntry(patterns=patterns, priority=priority)
+            entry.answers = [delta.Answer(text=answer)]
+            entry.macros = macros
+            self.delta.dictionary.append(entry)
+        self.delta.dictionary.sort()
+
+        issues = lint.lint_dictionary(self.delta.dictionary)
+        found = {(x["check"], x["entry"].split("=>")[0]) for x in issues}
+        self.assertEqual(
+            found,
+            {
+                ("shadowed-entry", "`hello there`"),
+                ("nested-quantifier", r"`(\w+\s?)+$`"),
+                ("overlapping-branch", r"`(\w|-?\d)+x`"),
+                ("quantifier-chain", r"`\w+\s*\w+$`"),
+                ("undefined-macro", "`hello`"),
+                ("unused-macro", r"`\$spare\$`"),
+            },
+        )
+
+        # exponential pattern is slow on short inputs, plain one is not
+        for pattern, slow in (("(a+)+$", True), ("a+b", False)):
+            seconds, inline = lint.fuzz_pattern(pattern, max_length=64, threshold=0.001)
+            self.assertEqual(seconds > 0.001, slow, pattern)
+            self.assertLessEqual(len(inline), 65)
+
 
 if __name__ == "__main__":
     unittest.main()